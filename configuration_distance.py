@@ -0,0 +1,515 @@
+# Copyright 2020 CNRS - Airbus SAS
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Distance between configurations
+#
+# HPP measures the distance between configurations with a weighted distance:
+# the squared distance is the sum over the joints of
+#
+#   weight [joint]**2 * || difference of the joint configurations ||**2,
+#
+# plus the squared norm of the difference of the extra configuration space,
+# where
+#   - the difference of a translation joint is the difference of the values,
+#   - the difference of a freeflyer joint is the translation difference and
+#     the angle of the relative rotation (R^3 x SO(3), not SE(3)),
+#   - the difference of an unbounded revolute joint is the angle between
+#     both values.
+#
+# Calling ps.hppcorba.problem.getDistance ().call (q0, q1) for each pair of
+# configurations costs one CORBA request per pair. Class
+# ConfigurationDistance reads the weights once and computes the whole matrix
+# of distances with array operations.
+#
+# Class ExecutionTime estimates in the same way the duration of the direct
+# paths between configurations after time parameterization by
+# SimpleTimeParameterization, from the velocity limits of the joints, the
+# safety factor on the velocity, the maximal acceleration and the order of
+# the time parameterization.
+#
+# Class ConfigurationIndex stores configurations in a vantage point tree, a
+# metric tree that only relies on the triangle inequality of the distance,
+# so that the angles of freeflyer and unbounded revolute joints are handled
+# exactly. It answers k-nearest neighbour and radius queries without
+# computing the whole matrix of distances.
+#
+# This module is copied, identical, in the directories of the demos that use
+# it (., talos/calibration/apriltags and talos/calibration/contact), like
+# common_hpp.py, so that the scripts run from their own directory without
+# installing it. Apply any change to all copies.
+
+import warnings
+import numpy as np
+
+class ConfigurationDistance(object):
+    """
+    Weighted distance between configurations of the robot of a problem
+      - ps: instance of ProblemSolver.
+
+    If the distance of the problem is not a weighted distance, or if the
+    robot contains joints that are not handled (planar or spherical joints),
+    a warning is issued and distances are computed by calling the distance
+    of the problem.
+    """
+    def __init__(self, ps):
+        self.ps = ps
+        robot = ps.robot
+        self.configSize = robot.getConfigSize()
+        self.vectorRanks = list(); self.vectorWeights = list()
+        self.so2Ranks = list(); self.so2Weights = list()
+        self.so3Ranks = list(); self.so3Weights = list()
+        # handled joints: list of (name, kind, rank in configuration)
+        self.joints = list()
+        self.local = False
+        weights = self.getWeights(ps)
+        if weights is None or len(weights) != len(robot.jointNames):
+            self.fallback('the distance of the problem is not a weighted '
+                          'distance')
+            return
+        rank = 0
+        for name, w in zip(robot.jointNames, weights):
+            r = robot.rankInConfiguration [name]
+            nq = robot.getJointConfigSize(name)
+            nv = robot.getJointNumberDof(name)
+            if nq == nv:
+                self.addVector(range(r, r+nq), w)
+                self.joints.append((name, 'vector', r))
+            elif nq == 7 and nv == 6:
+                # freeflyer: translation and quaternion (x, y, z, w)
+                self.addVector(range(r, r+3), w)
+                self.so3Ranks.append(range(r+3, r+7))
+                self.so3Weights.append(w)
+                self.joints.append((name, 'freeflyer', r))
+            elif nq == 2 and nv == 1:
+                # unbounded revolute joint: (cos, sin)
+                self.so2Ranks.append([r, r+1]); self.so2Weights.append(w)
+                self.joints.append((name, 'so2', r))
+            else:
+                self.fallback('joint {0} is not handled'.format(name))
+                return
+            rank = max(rank, r + nq)
+        # extra configuration space
+        self.addVector(range(rank, self.configSize), 1.)
+        self.vectorRanks = np.array(self.vectorRanks, dtype=int)
+        self.vectorWeights = np.array(self.vectorWeights)
+        self.so2Ranks = np.array(self.so2Ranks, dtype=int).reshape(-1, 2)
+        self.so2Weights = np.array(self.so2Weights)
+        self.so3Ranks = np.array(self.so3Ranks, dtype=int).reshape(-1, 4)
+        self.so3Weights = np.array(self.so3Weights)
+        self.local = True
+
+    @staticmethod
+    def getWeights(ps):
+        """
+        Weights of the joints of the distance of the problem, None if the
+        distance is not a weighted distance
+        """
+        from hpp_idl.hpp.core_idl import WeighedDistance
+        distance = ps.hppcorba.problem.getDistance()
+        weighed = distance._narrow(WeighedDistance)
+        if weighed is None:
+            return None
+        return list(weighed.getWeights())
+
+    def fallback(self, reason):
+        warnings.warn('{0}: {1}, distances are computed by one CORBA request '
+                      'per pair of configurations'.format
+                      (self.__class__.__name__, reason))
+
+    def addVector(self, ranks, weight):
+        for r in ranks:
+            self.vectorRanks.append(r); self.vectorWeights.append(weight)
+
+    def squaredDistances(self, Q0, Q1):
+        """
+        Squared distances between configurations
+          - Q0: array of dimension (M, configSize),
+          - Q1: array of dimension (N, configSize).
+        return array of dimension (M, N)
+        """
+        d = Q0 [:, None, self.vectorRanks] - Q1 [None, :, self.vectorRanks]
+        result = np.einsum('mnk,k->mn', d*d, self.vectorWeights**2)
+        if len(self.so2Weights) > 0:
+            angle = self.so2Angles(Q0, Q1)
+            result += np.einsum('mnk,k->mn', angle**2, self.so2Weights**2)
+        if len(self.so3Weights) > 0:
+            angle = self.so3Angles(Q0, Q1)
+            result += np.einsum('mnk,k->mn', angle**2, self.so3Weights**2)
+        return result
+
+    def so2Angles(self, Q0, Q1):
+        """
+        Angles between the values of the unbounded revolute joints
+        return array of dimension (M, N, number of joints)
+        """
+        c0 = Q0 [:, None, self.so2Ranks [:,0]]
+        s0 = Q0 [:, None, self.so2Ranks [:,1]]
+        c1 = Q1 [None, :, self.so2Ranks [:,0]]
+        s1 = Q1 [None, :, self.so2Ranks [:,1]]
+        return np.arctan2(c0*s1 - s0*c1, c0*c1 + s0*s1)
+
+    def so3Angles(self, Q0, Q1):
+        """
+        Angles of the relative rotations of the freeflyer joints
+        return array of dimension (M, N, number of joints)
+        """
+        q0 = Q0 [:, None, self.so3Ranks]
+        q1 = Q1 [None, :, self.so3Ranks]
+        # q and -q represent the same rotation
+        sign = np.where((q0*q1).sum(axis=-1) < 0, -1., 1.)
+        chord = np.linalg.norm(q0 - sign [..., None] * q1, axis=-1)
+        return 4 * np.arcsin(np.minimum(chord / 2, 1.))
+
+    def __call__(self, q0, q1):
+        """
+        Distance between two configurations
+        """
+        if not self.local:
+            return self.ps.hppcorba.problem.getDistance().call(q0, q1)
+        return float(np.sqrt(self.squaredDistances
+            (np.array([q0], dtype=float), np.array([q1], dtype=float)) [0,0]))
+
+    def distances(self, Q0, Q1):
+        """
+        Distances between configurations
+          - Q0: array of dimension (M, configSize),
+          - Q1: array of dimension (N, configSize).
+        return array of dimension (M, N)
+        """
+        if not self.local:
+            distance = self.ps.hppcorba.problem.getDistance()
+            return np.array([[distance.call(list(q0), list(q1)) for q1 in Q1]
+                             for q0 in Q0]).reshape(len(Q0), len(Q1))
+        return np.sqrt(np.maximum(self.squaredDistances(Q0, Q1), 0))
+
+    def matrix(self, configs, blockSize = 64):
+        """
+        Matrix of distances between configurations
+          - configs: list of N configurations,
+          - blockSize: number of rows computed at once, that bounds the memory
+            used by intermediate arrays.
+        return array of dimension (N, N)
+        """
+        N = len(configs)
+        if not self.local:
+            distance = self.ps.hppcorba.problem.getDistance()
+            dist = np.zeros((N, N))
+            for i in range(N):
+                for j in range(i+1, N):
+                    dist [i,j] = dist [j,i] = distance.call(configs [i],
+                                                            configs [j])
+            return dist
+        Q = np.array(configs, dtype=float).reshape(N, self.configSize)
+        dist = np.zeros((N, N))
+        for b in range(0, N, blockSize):
+            dist [b:b+blockSize] = np.sqrt(np.maximum(
+                self.squaredDistances(Q [b:b+blockSize], Q), 0))
+        np.fill_diagonal(dist, 0)
+        return dist
+
+class ExecutionTime(ConfigurationDistance):
+    """
+    Estimate of the duration of direct paths between configurations
+      - ps: instance of ProblemSolver,
+      - safety: ratio of the velocity limits used by the time
+        parameterization,
+      - order: order of the time parameterization (0: constant velocity,
+        1: cubic, 2: quintic polynomial of time),
+      - maxAcceleration: maximal acceleration of each degree of freedom, not
+        bounded if not positive,
+      - velocityLimits: dictionary of velocity limits by joint name. Limits
+        of other joints are read from the robot.
+    Parameters that are None are read in the parameters of the problem
+    ("SimpleTimeParameterization/safety", ...). If the distance cannot be
+    computed locally, a warning is issued and durations are replaced by the
+    distances between configurations.
+
+    Along a direct path, each degree of freedom moves by its difference
+    between both configurations with the same time law s(t), the maximal
+    velocity and acceleration of which are velocityFactor/T and
+    accelerationFactor/T^2 for a path of unit length and duration T. The
+    duration is the smallest T such that the velocity and the acceleration of
+    every degree of freedom are within limits. The rotation of a freeflyer
+    joint is bounded by the smallest of its angular velocity limits.
+    """
+    # maximal velocity and acceleration of s(t) by order
+    velocityFactor = [1., 1.5, 15./8]
+    accelerationFactor = [0., 6., 10./np.sqrt(3)]
+
+    def __init__(self, ps, safety = None, order = None,
+                 maxAcceleration = None, velocityLimits = dict()):
+        super(ExecutionTime, self).__init__(ps)
+        if not self.local:
+            warnings.warn('ExecutionTime: the execution time of paths cannot '
+                          'be estimated for this robot, distances are used '
+                          'instead')
+            return
+        if safety is None:
+            safety = ps.getParameter('SimpleTimeParameterization/safety')
+        if order is None:
+            order = ps.getParameter('SimpleTimeParameterization/order')
+        if maxAcceleration is None:
+            maxAcceleration = ps.getParameter \
+                ('SimpleTimeParameterization/maxAcceleration')
+        self.safety = safety
+        self.order = order
+        self.maxAcceleration = maxAcceleration
+        robot = ps.robot
+        # linear and angular components: ranks in configuration and limits
+        self.linearRanks = list(); self.linearLimits = list()
+        self.so2Limits = list(); self.so3Limits = list()
+        for name, kind, r in self.joints:
+            if name in velocityLimits:
+                v = list(velocityLimits [name])
+            else:
+                v = list(robot.hppcorba.robot.getJointVelocityUpperBound(name))
+            if kind == 'vector':
+                self.linearRanks += range(r, r+len(v))
+                self.linearLimits += v
+            elif kind == 'freeflyer':
+                self.linearRanks += range(r, r+3)
+                self.linearLimits += v [0:3]
+                self.so3Limits.append(min(v [3:6]))
+            else:
+                self.so2Limits.append(v [0])
+        self.linearRanks = np.array(self.linearRanks, dtype=int)
+        self.linearLimits = np.array(self.linearLimits)
+        self.so2Limits = np.array(self.so2Limits)
+        self.so3Limits = np.array(self.so3Limits)
+
+    def durations(self, Q0, Q1):
+        """
+        Durations of the direct paths between configurations
+          - Q0: array of dimension (M, configSize),
+          - Q1: array of dimension (N, configSize).
+        return array of dimension (M, N)
+        """
+        if not self.local:
+            return self.distances(Q0, Q1)
+        # displacements and velocity limits of the degrees of freedom
+        d = [np.abs(Q0 [:, None, self.linearRanks] -
+                    Q1 [None, :, self.linearRanks])]
+        limits = [self.linearLimits]
+        if len(self.so2Limits) > 0:
+            d.append(np.abs(self.so2Angles(Q0, Q1)))
+            limits.append(self.so2Limits)
+        if len(self.so3Limits) > 0:
+            d.append(self.so3Angles(Q0, Q1))
+            limits.append(self.so3Limits)
+        d = np.concatenate(d, axis=-1)
+        limits = np.concatenate(limits)
+        order = min(max(int(self.order), 0), 2)
+        T = np.max(self.velocityFactor [order] * d / (self.safety * limits),
+                   axis=-1)
+        if self.maxAcceleration > 0 and order > 0:
+            Ta = np.sqrt(self.accelerationFactor [order] * d.max(axis=-1) /
+                         self.maxAcceleration)
+            T = np.maximum(T, Ta)
+        return T
+
+    def matrix(self, configs, blockSize = 64):
+        """
+        Matrix of durations of the direct paths between configurations
+          - configs: list of N configurations,
+          - blockSize: number of rows computed at once.
+        return array of dimension (N, N)
+        """
+        if not self.local:
+            return super(ExecutionTime, self).matrix(configs, blockSize)
+        N = len(configs)
+        Q = np.array(configs, dtype=float).reshape(N, self.configSize)
+        T = np.zeros((N, N))
+        for b in range(0, N, blockSize):
+            T [b:b+blockSize] = self.durations(Q [b:b+blockSize], Q)
+        np.fill_diagonal(T, 0)
+        return T
+
+class ConfigurationIndex(object):
+    """
+    Vantage point tree over configurations
+      - distance: instance of ConfigurationDistance,
+      - configs: list of N configurations,
+      - leafSize: maximal number of configurations in a leaf, the distances
+        of which to the query are computed at once,
+      - seed: seed of the random choice of the vantage points.
+
+    Each node stores a vantage point v and the median mu of the distances of
+    its configurations to v: configurations at distance lower than mu are in
+    the inside child, the others in the outside child. By the triangle
+    inequality, a configuration of the inside child is at least at distance
+    d(q,v) - mu from a query q, and a configuration of the outside child at
+    least at distance mu - d(q,v), which allows skipping subtrees.
+
+    If distance cannot be computed locally, the matrix of distances between
+    the indexed configurations is computed once, so that the number of CORBA
+    requests does not exceed one per pair of configurations.
+    """
+    def __init__(self, distance, configs, leafSize = 64, seed = 0):
+        self.distance = distance
+        N = len(configs)
+        self.Q = np.array(configs, dtype=float).reshape(N, -1)
+        self.leafSize = leafSize
+        if distance.local:
+            self.cache = None
+        else:
+            self.cache = distance.matrix([list(q) for q in self.Q])
+        rng = np.random.RandomState(seed)
+        # nodes: vantage point, median, inside child, outside child, leaf
+        self.vantage = list(); self.median = list()
+        self.inside = list(); self.outside = list(); self.leaves = list()
+        self.root = self.build(np.arange(N), rng)
+
+    def __len__(self):
+        return len(self.Q)
+
+    def addNode(self, vantage, median, leaf):
+        self.vantage.append(vantage); self.median.append(median)
+        self.inside.append(None); self.outside.append(None)
+        self.leaves.append(leaf)
+        return len(self.vantage) - 1
+
+    def distances(self, Q, ids, configs):
+        """
+        Distances between queries and indexed configurations
+          - Q: array of queries,
+          - ids: index of each query in the indexed configurations (-1 if
+            it is not an indexed configuration),
+          - configs: indices of configurations.
+        return array of dimension (len(Q), len(configs))
+        """
+        if self.cache is not None and np.all(ids >= 0):
+            return self.cache [np.ix_(ids, configs)]
+        return self.distance.distances(Q, self.Q [configs])
+
+    def build(self, indices, rng):
+        if len(indices) <= self.leafSize:
+            return self.addNode(None, None, indices)
+        k = rng.randint(len(indices))
+        v = indices [k]
+        rest = np.delete(indices, k)
+        d = self.distances(self.Q [v:v+1], np.array([v]), rest) [0]
+        order = np.argsort(d, kind='mergesort')
+        half = len(rest) // 2
+        node = self.addNode(v, d [order [half-1]], None)
+        self.inside [node] = self.build(rest [order [:half]], rng)
+        self.outside [node] = self.build(rest [order [half:]], rng)
+        return node
+
+    def traverse(self, node, Q, ids, active, tau, visit):
+        """
+        Visit the subtree of node with the queries Q [active] that may have
+        neighbours in it
+          - ids: index of each query in the indexed configurations,
+          - tau: array of current search radius of each query, that visit may
+            decrease,
+          - visit: function called with the indices of the queries, the
+            indices of configurations and the matrix of their distances.
+        """
+        leaf = self.leaves [node]
+        if leaf is not None:
+            visit(active, leaf, self.distances(Q [active], ids [active], leaf))
+            return
+        v = self.vantage [node]
+        dv = self.distances(Q [active], ids [active], np.array([v])) [:,0]
+        visit(active, np.array([v]), dv [:,None])
+        mu = self.median [node]
+        inside = (self.inside [node], np.maximum(dv - mu, 0.))
+        outside = (self.outside [node], np.maximum(mu - dv, 0.))
+        near = dv <= mu
+        # visit the closest child first
+        for group, children in [(near, [inside, outside]),
+                                (~near, [outside, inside])]:
+            for child, bound in children:
+                select = group & (bound <= tau [active])
+                if select.any():
+                    self.traverse(child, Q, ids, active [select], tau, visit)
+
+    def queries(self, queries):
+        """
+        Array of queries and index of each query in the indexed
+        configurations (-1 if queries are not the indexed configurations)
+        """
+        if queries is None:
+            return self.Q, np.arange(len(self.Q))
+        Q = np.array(queries, dtype=float).reshape(len(queries), -1)
+        return Q, -np.ones(len(Q), dtype=int)
+
+    def kNearest(self, k, queries = None):
+        """
+        k nearest neighbours of configurations
+          - k: number of neighbours,
+          - queries: list of configurations, if None, neighbours of the
+            indexed configurations, excluding themselves.
+        return arrays of dimension (M, k) of indices and of distances of the
+        neighbours sorted by distance (-1 and inf where there are less than k
+        neighbours)
+        """
+        Q, self_ = self.queries(queries)
+        M = len(Q)
+        indices = -np.ones((M, k), dtype=int)
+        distances = np.full((M, k), np.inf)
+        tau = np.full(M, np.inf)
+        def visit(active, configs, d):
+            d = np.where(configs [None,:] == self_ [active,None], np.inf, d)
+            allD = np.hstack((distances [active], d))
+            allI = np.hstack((indices [active],
+                              np.broadcast_to(configs, d.shape)))
+            best = np.argpartition(allD, k-1, axis=1) [:,:k]
+            rows = np.arange(len(active)) [:,None]
+            distances [active] = allD [rows, best]
+            indices [active] = allI [rows, best]
+            tau [active] = distances [active].max(axis=1)
+        if M > 0 and k > 0 and len(self.Q) > 0:
+            self.traverse(self.root, Q, self_, np.arange(M), tau, visit)
+        order = np.argsort(distances, axis=1, kind='mergesort')
+        rows = np.arange(M) [:,None]
+        distances = distances [rows, order]
+        indices = np.where(np.isinf(distances), -1, indices [rows, order])
+        return indices, distances
+
+    def radius(self, r, queries = None):
+        """
+        Neighbours of configurations within distance r
+          - queries: list of configurations, if None, neighbours of the
+            indexed configurations, excluding themselves.
+        return for each query, the list of indices and the list of distances
+        of the neighbours sorted by distance
+        """
+        Q, self_ = self.queries(queries)
+        M = len(Q)
+        found = [list() for m in range(M)]
+        tau = np.full(M, float(r))
+        def visit(active, configs, d):
+            for a, j in zip(*np.nonzero(d <= r)):
+                if configs [j] != self_ [active [a]]:
+                    found [active [a]].append((d [a,j], int(configs [j])))
+        if M > 0 and len(self.Q) > 0:
+            self.traverse(self.root, Q, self_, np.arange(M), tau, visit)
+        result = list()
+        for f in found:
+            f.sort()
+            result.append(([i for d, i in f], [d for d, i in f]))
+        return result
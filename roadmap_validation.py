@@ -0,0 +1,139 @@
+# Copyright 2020 CNRS - Airbus SAS
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Validation of roadmap edges in parallel
+#
+# Validating a direct path between two configurations (collision checking
+# along the path) is a blocking request to the server. The server can hold
+# several problems, each in its own context: EdgeValidator creates several
+# contexts containing the same problem and sends the validation requests of
+# different edges to different contexts from a pool of threads, so that they
+# are processed concurrently by the server.
+#
+# Usage:
+#   validator = EdgeValidator (makeProblem, nContexts = 4)
+#   valid = validator.validate (configs, [(0, 1), (0, 2), (1, 2)])
+#   validator.close ()
+#
+# where makeProblem (client) builds the problem (robot, constraints,
+# constraint graph) with the given CorbaClient and returns the ProblemSolver
+# instance. As each context holds a copy of the problem, close () deletes the
+# contexts from the server once the validation is over.
+#
+# This module is copied, identical, in the directories of the demos that use
+# it (., talos/calibration/apriltags and talos/calibration/contact), like
+# common_hpp.py, so that the scripts run from their own directory without
+# installing it. Apply any change to all copies.
+
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+def _validateEdges(args):
+    """
+    Validate direct paths in one context
+    return list of booleans
+    """
+    ps, configs, edges = args
+    result = list()
+    for i, j in edges:
+        res, pid, msg = ps.directPath(configs [i], configs [j], True)
+        result.append(res)
+    # paths are only needed in the main context
+    for i in range(ps.numberPaths(), 0, -1):
+        ps.erasePath(i-1)
+    return result
+
+class EdgeValidator(object):
+    """
+    Validation of direct paths in several contexts of the server
+      - makeProblem: function that takes an instance of CorbaClient and
+        returns an instance of ProblemSolver built with this client, with the
+        same robot, constraints and constraint graph as the main problem,
+      - nContexts: number of contexts,
+      - prefix: prefix of the names of the contexts.
+    """
+    def __init__(self, makeProblem, nContexts = None, prefix = 'roadmap_'):
+        from hpp.corbaserver import createContext, loadServerPlugin
+        from hpp.corbaserver.manipulation.robot import CorbaClient
+        self.contexts = list()
+        self.clients = list()
+        self.problems = list()
+        try:
+            for k in range(nContexts or cpu_count()):
+                name = prefix + str(k)
+                createContext(name)
+                self.contexts.append(name)
+                loadServerPlugin(name, "manipulation-corba.so")
+                client = CorbaClient(context=name)
+                self.clients.append(client)
+                client.manipulation.problem.resetProblem()
+                self.problems.append(makeProblem(client))
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        """
+        Delete the contexts from the server
+        """
+        if len(self.contexts) > 0:
+            # the tools of the server are shared by all contexts
+            if len(self.clients) > 0:
+                tools = self.clients [0].basic.tools
+            else:
+                from hpp.corbaserver import Client
+                tools = Client().tools
+            for name in self.contexts:
+                tools.deleteContext(name)
+        self.contexts = list()
+        self.clients = list()
+        self.problems = list()
+
+    def validate(self, configs, edges):
+        """
+        Validate the direct paths of edges
+          - configs: list of configurations,
+          - edges: list of pairs (i, j) of indices in configs.
+        return list of booleans, True if the direct path from configs [i] to
+        configs [j] is valid
+        """
+        n = len(self.problems)
+        if n == 0:
+            raise RuntimeError('the contexts of the validator are closed')
+        if len(edges) == 0:
+            return list()
+        # edges are distributed in turn to the contexts
+        chunks = [(ps, configs, edges [k::n])
+                  for k, ps in enumerate(self.problems)]
+        pool = ThreadPool(n)
+        try:
+            results = pool.map(_validateEdges, chunks)
+        finally:
+            pool.close(); pool.join()
+        valid = [False] * len(edges)
+        for k, r in enumerate(results):
+            valid [k::n] = r
+        return valid
@@ -0,0 +1,249 @@
+# Copyright 2020 CNRS - Airbus SAS
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Benchmark of the calibration solvers on synthetic data
+#
+# Measurements are generated from known calibration parameters: the joint
+# values are drawn around the configurations of a template file (by default
+# data/measures-simulation.csv) and the measured poses of the supports are
+# the poses predicted by the model, with Gaussian noise and a ratio of
+# outliers. The problem is then solved from the initial guess for each
+# combination of number of measurements, noise level and outlier ratio:
+#
+#   python benchmark.py --counts 10 100 1000 10000 --noise 0 1e-3 \
+#       --outliers 0 .05 --output benchmark.csv
+#
+# Each line of the output (CSV, or JSON if the file name ends with .json)
+# contains the parameters of the run, the number of iterations, the wall
+# time, the peak memory allocated during the resolution and the errors on
+# the calibration parameters. Some combinations of parameters cannot be
+# identified (for instance the offset of head_1_joint and the rotation of
+# the camera about the same axis): parameter errors are projected onto the
+# identifiable directions. The prediction error is the RMS error of the
+# estimated model on noiseless measurements that are not used to solve.
+
+import argparse, json, os, shutil, tempfile, time
+import numpy as np
+from csv import DictWriter
+from pinocchio import exp6, Quaternion
+from compute_calibration import ComputeCalibration, exp6Batch, \
+    initialVariable, retractBatch
+from measurements import Measurements
+from bootstrap import parameterDifference
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2: peak memory is not measured
+    tracemalloc = None
+
+fields = ['measurements', 'noise', 'outliers', 'seed', 'solver',
+          'iterations', 'converged', 'setupTime', 'time',
+          'timePerIteration', 'peakMemory', 'cost', 'jointOffsetError',
+          'cameraTranslationError', 'cameraRotationError', 'parameterError',
+          'predictionError']
+
+def identifiableProjection(jacobian, tolerance = 1e-8):
+    """
+    Orthogonal projector onto the directions of the parameter space that
+    are identified by measurements of given Jacobian
+    """
+    U, s, Vt = np.linalg.svd(jacobian, full_matrices = False)
+    V = Vt[s > tolerance*s[0]].T
+    return V.dot(V.T)
+
+def perturbVariable(variable, offsetStd, transformStd, rng):
+    """
+    Random calibration parameters around a variable
+      - offsetStd: standard deviation of the joint offsets,
+      - transformStd: standard deviation of the perturbation of hTc and
+        of the supports in the tangent space,
+      - rng: instance of numpy.random.RandomState.
+    """
+    v = variable.copy()
+    v.q_off = v.q_off + rng.normal(0, offsetStd, v.q_off.shape)
+    v.hTc = v.hTc*exp6(rng.normal(0, transformStd, 6))
+    v.setSupports([T*exp6(rng.normal(0, transformStd, 6))
+                   for T in v.supports()])
+    return v
+
+class SyntheticData(object):
+    """
+    Generator of measurements from known calibration parameters
+      - calibration: instance of ComputeCalibration,
+      - template: measurements the configurations of which are sampled.
+    """
+    # Standard deviation of the noise added to the template configurations
+    jointNoise = 0.05
+    # Standard deviation of the error of an outlier
+    outlierStd = 0.1
+
+    def __init__(self, calibration, template):
+        self.calibration = calibration
+        indices = [template.jointNames.index(j) for j in calibration.joints]
+        self.configurations = np.asarray(template.jointStates)[:,indices]
+        self.gripper = np.asarray(template.gripper)
+
+    def generate(self, truth, M, noise, outlierRatio, rng):
+        """
+        Generate M measurements
+          - truth: calibration parameters used to predict the measurements,
+          - noise: standard deviation of the measurement error in the
+            tangent space,
+          - outlierRatio: ratio of measurements with an error of standard
+            deviation outlierStd.
+        return an instance of Measurements
+        """
+        cc = self.calibration
+        k = rng.randint(len(self.configurations), size=M)
+        q = self.configurations[k] + rng.normal(0, self.jointNoise,
+                                                (M, len(cc.joints)))
+        gripper = self.gripper[k]
+        # With identity measurements, the error is the predicted pose.
+        variable = cc.variable
+        cc.variable = truth
+        value, J = cc.evaluate(q, gripper == 0, np.tile(np.eye(3), (M,1,1)),
+                               np.zeros((M,3)))
+        cc.variable = variable
+        errors = rng.normal(0, noise, (M,6))
+        outliers = rng.uniform(size=M) < outlierRatio
+        errors[outliers] += rng.normal(0, self.outlierStd,
+                                       (outliers.sum(), 6))
+        R, p = retractBatch(*exp6Batch(value), nu = errors)
+        poses = np.zeros((M,7))
+        poses[:,0:3] = p
+        for im in range(M):
+            poses[im,3:7] = Quaternion(R[im]).coeffs().reshape(4)
+        return Measurements(cc.joints, q, gripper.astype(np.int8), poses,
+                            np.arange(2, M+2, dtype=np.int32),
+                            ['synthetic'], np.array([0, M]))
+
+def run(urdfFilename, template, M, noise, outlierRatio, seed,
+        solver = 'lm', offsetStd = 0.01, transformStd = 0.01,
+        validationSize = 1000):
+    """
+    Solve a calibration problem on synthetic data
+    return a dictionary with the keys of list fields
+    """
+    rng = np.random.RandomState(seed)
+    initial = initialVariable()
+    truth = perturbVariable(initial, offsetStd, transformStd, rng)
+    t0 = time.time()
+    cc = ComputeCalibration(urdfFilename, initial.copy())
+    cc.verbose = False
+    data = SyntheticData(cc, template)
+    measurements = data.generate(truth, M, noise, outlierRatio, rng)
+    validation = data.generate(truth, validationSize, 0., 0., rng)
+    directory = tempfile.mkdtemp()
+    try:
+        measurements.save(directory)
+        cc.readData(directory)
+        setupTime = time.time() - t0
+        if tracemalloc: tracemalloc.start()
+        # wall time of the whole solver, all reweightings included, and
+        # iterations summed over the reweightings by solveRobust
+        t1 = time.time()
+        if solver == 'robust':
+            report = cc.solveRobust()
+        else:
+            report = cc.solveLevenbergMarquardt()
+        solveTime = time.time() - t1
+        peak = None
+        if tracemalloc:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(directory)
+    nj = len(cc.joints)
+    value, J = cc.evaluate(validation.jointStates, validation.left,
+                           validation.rotations(), validation.translations())
+    d = identifiableProjection(J.reshape(-1, cc.cols)).dot \
+        (parameterDifference(cc.variable, truth))
+    return dict(measurements = M, noise = noise, outliers = outlierRatio,
+                seed = seed, solver = solver,
+                iterations = report['iterations'],
+                converged = report['converged'], setupTime = setupTime,
+                time = solveTime,
+                timePerIteration = solveTime/report['iterations']
+                if report['iterations'] > 0 else None,
+                peakMemory = peak, cost = report['cost'],
+                jointOffsetError = np.abs(d[0:nj]).max(),
+                cameraTranslationError = np.linalg.norm(d[nj:nj+3]),
+                cameraRotationError = np.linalg.norm(d[nj+3:nj+6]),
+                parameterError = np.linalg.norm(d),
+                predictionError = np.sqrt(np.mean(np.sum(value**2, axis=1))))
+
+def write(filename, results):
+    """
+    Write results in JSON format if filename ends with .json, in CSV
+    format otherwise
+    """
+    with open(filename, 'w') as f:
+        if filename.endswith('.json'):
+            json.dump(results, f, indent=2)
+        else:
+            w = DictWriter(f, fields)
+            w.writeheader()
+            w.writerows(results)
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description=
+        'Benchmark the calibration solvers on synthetic measurements')
+    p.add_argument('--urdf', type=str, default=os.path.join(
+        os.getenv('DEVEL_HPP_DIR', ''),
+        'install/share/talos_data/urdf/pyrene.urdf'), help='robot model')
+    p.add_argument('--template', type=str,
+                   default='data/measures-simulation.csv',
+                   help='measurements the configurations of which are '
+                   'sampled')
+    p.add_argument('--counts', type=int, nargs='+',
+                   default=[10, 100, 1000, 10000],
+                   help='numbers of measurements')
+    p.add_argument('--noise', type=float, nargs='+', default=[0., 1e-3, 1e-2],
+                   help='standard deviations of the measurement noise')
+    p.add_argument('--outliers', type=float, nargs='+', default=[0., .05],
+                   help='ratios of outliers')
+    p.add_argument('--solver', type=str, choices=['lm', 'robust'],
+                   default='lm', help='Levenberg-Marquardt or robust loss')
+    p.add_argument('--repeat', type=int, default=1,
+                   help='number of runs of each configuration')
+    p.add_argument('--output', type=str, default='benchmark.csv',
+                   help='output file (CSV or JSON)')
+    args = p.parse_args()
+
+    template = Measurements.readCsv(args.template)
+    results = list()
+    for M in args.counts:
+        for noise in args.noise:
+            for outlierRatio in args.outliers:
+                for seed in range(args.repeat):
+                    r = run(args.urdf, template, M, noise, outlierRatio,
+                            seed, args.solver)
+                    print('M = {measurements}, noise = {noise}, outliers = '
+                          '{outliers}: {iterations} iterations in {time:.3f} '
+                          's, prediction error {predictionError:.2e}'.format
+                          (**r))
+                    results.append(r)
+    write(args.output, results)
@@ -0,0 +1,192 @@
+# Copyright 2020 CNRS - Airbus SAS
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Uncertainty of the calibration parameters
+#
+# The calibration problem is solved again on measurement sets drawn with
+# replacement from the measurements, in a pool of processes. The dispersion
+# of the solutions gives standard deviations and correlations of the
+# parameters, expressed in the tangent space at the estimate: offsets for
+# q_off, log6 (T_estimate^{-1} T) for the transformations.
+#
+# Usage, after solving the problem:
+#
+#   from bootstrap import Bootstrap
+#   b = Bootstrap(cc, nSamples=200)
+#   b.run()
+#   b.write('bootstrap.csv')
+#   b.isSignificant(previousVariable)
+
+import numpy as np
+from csv import writer
+from multiprocessing import Pool, cpu_count
+from pinocchio import log6, SE3
+
+def variableState(variable):
+    """
+    Picklable copy of a calibration variable
+    """
+    return (variable.__class__, variable.q_off.copy(),
+            np.array(variable.hTc.homogeneous),
+            [np.array(T.homogeneous) for T in variable.supports()])
+
+def variableFromState(state):
+    cls, q_off, hTc, supports = state
+    variable = cls(q_off.copy(), SE3(hTc), None, None)
+    variable.setSupports([SE3(T) for T in supports])
+    return variable
+
+def parameterDifference(variable, reference):
+    """
+    Difference between two variables in the tangent space at reference,
+    in the order of the columns of the Jacobian
+    """
+    d = [variable.q_off.reshape(-1) - reference.q_off.reshape(-1)]
+    for T, T0 in zip([variable.hTc] + variable.supports(),
+                     [reference.hTc] + reference.supports()):
+        d.append(log6(T0.inverse()*T).vector)
+    return np.concatenate(d)
+
+# Calibration problem of the current worker process
+_calibration = None
+
+def _initWorker(cls, urdfFilename, dataFiles, state, attributes):
+    global _calibration
+    _calibration = cls(urdfFilename, variableFromState(state))
+    for k, v in attributes.items():
+        setattr(_calibration, k, v)
+    for f in dataFiles:
+        _calibration.readData(f)
+
+def _solveSample(args):
+    """
+    Solve the problem weighted by the resampled counts of the measurements
+    """
+    state, counts, maxIterations = args
+    cc = _calibration
+    reference = variableFromState(state)
+    cc.variable = variableFromState(state)
+    cc.weights = counts
+    cc.solveLevenbergMarquardt(maxIterations)
+    return parameterDifference(cc.variable, reference)
+
+class Bootstrap(object):
+    """
+    Bootstrap estimation of the uncertainty of calibration parameters
+      - calibration: instance of ComputeCalibration (or of a derived class)
+        the problem of which has been solved,
+      - nSamples: number of resampled measurement sets,
+      - nProcesses: number of worker processes,
+      - seed: seed of the random number generator.
+
+    Measurements are resampled within each session, so that each session
+    keeps the same number of measurements.
+
+    The weight of a measurement in a resampled problem is its number of
+    occurrences times its weight in calibration.weights. If the estimate has
+    been computed by solveRobust, the robust weights of the final iteration
+    are thus kept fixed: rejected measurements stay rejected, and the
+    uncertainty is the one of the robust estimator around its solution.
+    """
+    def __init__(self, calibration, nSamples = 200, nProcesses = None,
+                 seed = 0):
+        self.calibration = calibration
+        self.nSamples = nSamples
+        self.nProcesses = nProcesses or cpu_count()
+        self.seed = seed
+
+    def resample(self, rng):
+        """
+        Number of occurrences of each measurement in a resampled set
+        """
+        offsets = self.calibration.measurements.sessionOffsets
+        counts = np.zeros(offsets[-1])
+        for b, e in zip(offsets[:-1], offsets[1:]):
+            counts[b:e] = rng.multinomial(e - b, np.full(e - b, 1./(e - b)))
+        return counts
+
+    def run(self, maxIterations = 50):
+        """
+        Solve the problem for each resampled set, starting from the current
+        estimate, and compute
+          - self.samples (nSamples, cols): solutions in the tangent space at
+            the estimate,
+          - self.std (cols,): standard deviations of the parameters,
+          - self.correlation (cols, cols): correlations of the parameters.
+        """
+        cc = self.calibration
+        state = variableState(cc.variable)
+        rng = np.random.RandomState(self.seed)
+        # resampled counts times the weights of the estimate
+        weights = np.asarray(cc.weights, dtype=float)
+        tasks = [(state, self.resample(rng)*weights, maxIterations)
+                 for i in range(self.nSamples)]
+        initArgs = (cc.__class__, cc.urdfFilename, cc.dataFiles, state,
+                    dict(verbose = False, nThreads = 1,
+                         vectorized = cc.vectorized))
+        if self.nProcesses > 1:
+            pool = Pool(self.nProcesses, _initWorker, initArgs)
+            try:
+                samples = pool.map(_solveSample, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _initWorker(*initArgs)
+            samples = [_solveSample(t) for t in tasks]
+        self.samples = np.array(samples)
+        self.std = self.samples.std(axis = 0, ddof = 1)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            self.correlation = np.corrcoef(self.samples, rowvar = False)
+        return self.std, self.correlation
+
+    def significance(self, variable):
+        """
+        Difference between a variable and the estimate, in number of
+        standard deviations, for each parameter
+        """
+        d = parameterDifference(variable, self.calibration.variable)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return np.abs(d)/self.std
+
+    def isSignificant(self, variable, nSigma = 3.):
+        """
+        Whether the estimate differs from variable (for instance the
+        calibration currently in the robot description) by more than nSigma
+        standard deviations on at least one parameter
+        """
+        return bool(np.any(self.significance(variable) > nSigma))
+
+    def write(self, filename):
+        """
+        Write standard deviations and correlations in CSV format
+        """
+        names = self.calibration.parameterNames()
+        with open(filename, 'w') as f:
+            w = writer(f)
+            w.writerow(['parameter', 'std'] + names)
+            for i, n in enumerate(names):
+                w.writerow([n, self.std[i]] + list(self.correlation[i]))
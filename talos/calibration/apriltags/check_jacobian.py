@@ -0,0 +1,139 @@
+# Copyright 2020 CNRS - Airbus SAS
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Finite-difference verification of the Jacobian of the calibration problem
+#
+# Each column of the Jacobian computed by ComputeCalibration is compared to
+# the central difference of the errors along the corresponding parameter.
+# Perturbed evaluations run in a pool of processes, each of them holding its
+# own model, and may be restricted to random subsets of the measurements
+# and of the columns.
+#
+# Usage, after reading the data:
+#
+#   from check_jacobian import JacobianCheck
+#   c = JacobianCheck(cc, nMeasurements = 50, nColumns = 10)
+#   c.run()
+#   c.printTable()
+
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from bootstrap import variableFromState, variableState
+
+# Calibration problem and measurements of the current worker process
+_calibration = None
+_measurements = None
+
+def _initWorker(cls, urdfFilename, state, measurements):
+    global _calibration, _measurements
+    _calibration = cls(urdfFilename, variableFromState(state))
+    _calibration.nThreads = 1
+    _measurements = measurements
+
+def _finiteDifference(args):
+    state, column, dq = args
+    cc = _calibration
+    values = list()
+    for delta in [-dq, dq]:
+        cc.variable = variableFromState(state)
+        dy = np.zeros((cc.cols, 1))
+        dy[column] = delta
+        cc.applyStep(dy)
+        values.append(cc.evaluate(*_measurements)[0].reshape(-1))
+    return (values[1] - values[0])/(2*dq)
+
+class JacobianCheck(object):
+    """
+    Comparison of the Jacobian of a calibration problem with finite
+    differences
+      - calibration: instance of ComputeCalibration (or of a derived class)
+        the data of which have been read,
+      - nMeasurements: number of measurements randomly selected, all if None,
+      - nColumns: number of columns randomly selected, all if None,
+      - nProcesses: number of worker processes,
+      - seed: seed of the random number generator,
+      - dq: step of the finite differences.
+    """
+    def __init__(self, calibration, nMeasurements = None, nColumns = None,
+                 nProcesses = None, seed = 0, dq = 1e-6):
+        cc = calibration
+        self.calibration = cc
+        self.nProcesses = nProcesses or cpu_count()
+        self.dq = dq
+        rng = np.random.RandomState(seed)
+        M = len(cc.measurements)
+        self.measurementIndices = np.arange(M) if nMeasurements is None or \
+            nMeasurements >= M else \
+            np.sort(rng.choice(M, nMeasurements, replace = False))
+        self.columns = np.arange(cc.cols) if nColumns is None or \
+            nColumns >= cc.cols else \
+            np.sort(rng.choice(cc.cols, nColumns, replace = False))
+
+    def run(self):
+        """
+        Compute
+          - self.jacobian (6 nMeasurements, nColumns): selected rows and
+            columns of the Jacobian,
+          - self.finiteDifferences: the same by central differences,
+          - self.errors (nColumns,): norm of the difference for each column,
+          - self.relativeErrors (nColumns,): the same divided by the norm of
+            the column.
+        """
+        cc = self.calibration
+        i = self.measurementIndices
+        measurements = (cc.q_meas[i], cc.left[i], cc.meas_R[i],
+                        cc.meas_p[i], cc.supportIndex[i])
+        state = variableState(cc.variable)
+        J = cc.evaluate(*measurements)[1].reshape(-1, cc.cols)
+        self.jacobian = J[:,self.columns]
+        tasks = [(state, c, self.dq) for c in self.columns]
+        initArgs = (cc.__class__, cc.urdfFilename, state, measurements)
+        if self.nProcesses > 1:
+            pool = Pool(self.nProcesses, _initWorker, initArgs)
+            try:
+                columns = pool.map(_finiteDifference, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _initWorker(*initArgs)
+            columns = [_finiteDifference(t) for t in tasks]
+        self.finiteDifferences = np.array(columns).T
+        difference = self.finiteDifferences - self.jacobian
+        self.errors = np.linalg.norm(difference, axis = 0)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            self.relativeErrors = self.errors / \
+                np.linalg.norm(self.jacobian, axis = 0)
+        return self.errors
+
+    def printTable(self):
+        names = self.calibration.parameterNames()
+        print('{:<28} {:>10} {:>10} {:>10}'.format
+              ('parameter', '||J||', '||error||', 'relative'))
+        for k, c in enumerate(self.columns):
+            print('{:<28} {:10.3e} {:10.3e} {:10.3e}'.format
+                  (names[c], np.linalg.norm(self.jacobian[:,k]),
+                   self.errors[k], self.relativeErrors[k]))
@@ -24,75 +24,327 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import os
+import argparse, copy, json, os, sys, time
+from glob import glob
+from multiprocessing import cpu_count, Pool
+from multiprocessing.pool import ThreadPool
 import numpy as np, pinocchio
 from numpy.linalg import norm, pinv
-from csv import reader
-from pinocchio import computeJointJacobians, forwardKinematics, \
-    getJointJacobian, integrate, Jlog6, JointModelFreeFlyer, log6, Model, \
-    neutral, Quaternion, ReferenceFrame, SE3
-from pinocchio.robot_wrapper import RobotWrapper
+from csv import writer
+from pinocchio import buildModelFromUrdf, buildReducedModel, \
+    computeJointJacobians, exp6, forwardKinematics, getJointJacobian, \
+    Jlog6, log6, neutral, Quaternion, ReferenceFrame, SE3
+from measurements import Measurements
+from telemetry import errorStatistics, Telemetry
 pinocchio.switchToNumpyArray()
 
-def parseLine(line, i):
-    # check that line starts with joint_states
-    if line [0] != 'joint_states':
-        raise RuntimeError('line {} does not start by keyword "joint_states"'
-                            .format(i))
-    # look for keyword
-    ilg = irg = None
-    # make sure that one and only one of 'left_gripper' and 'right_gripper'
-    # is specified in the current line.
-    try:
-        ilg = line.index('left_gripper')
-    except ValueError as exc:
-        pass
-    try:
-        irg = line.index('right_gripper')
-    except ValueError as exc:
-        pass
-    if irg is None and ilg is None:
-        raise SyntaxError \
-           ('line {} contains neither "left_gripper" nor "right_gripper" tag.'
-             .format(i+1))
-    if not irg is None and not ilg is None:
-        raise SyntaxError \
-           ('line {} contains both "left_gripper" and "right_gripper" tags.'
-             .format(i+1))
-    measurement = dict()
-    if ilg:
-        try:
-            measurement['joint_states'] = map(float, line [1:ilg])
-        except ValueError as exc:
-            raise SyntaxError\
-           ('line {}, tag "joint_states": could not convert list {} to array'.
-                               format(i+1, line [1:ilg]))
-        try:
-            v = map(float, line [ilg+1:])
-            p = Quaternion(x=v[3], y=v[4], z=v[5], w=v[6])
-            t = np.array(v[0:3]).reshape(3,1)
-            measurement ['left_gripper'] = SE3(p,t)
-        except ValueError as exc:
-            raise SyntaxError\
-           ('line {}, tag "left_gripper": could not convert list {} to array'.
-                               format(i+1, line [ilg+1:]))
-    if irg:
-        try:
-            measurement ['joint_states'] = map(float, line [1:irg])
-        except ValueError as exc:
-            raise SyntaxError\
-           ('line {}, tag "joint_states": could not convert list {} to float'.
-                               format(i+1, line [1:irg]))
-        try:
-            v = map(float, line [irg+1:])
-            p = Quaternion(x=v[3], y=v[4], z=v[5], w=v[6])
-            t = np.array(v[0:3]).reshape(3,1)
-            measurement ['right_gripper'] =  SE3(p,t)
-        except ValueError as exc:
-            raise SyntaxError\
-           ('line {}, tag "right_gripper": could not convert list {} to float'.
-                               format(i+1, line [irg+1:]))
-    return measurement
+def skew(v):
+    """
+    Batch of skew-symmetric matrices
+      - v: numpy array of dimension (...,3)
+    return numpy array of dimension (...,3,3)
+    """
+    S = np.zeros(v.shape + (3,))
+    S[...,0,1] = -v[...,2]; S[...,0,2] =  v[...,1]
+    S[...,1,0] =  v[...,2]; S[...,1,2] = -v[...,0]
+    S[...,2,0] = -v[...,1]; S[...,2,1] =  v[...,0]
+    return S
+
+# Angle under which Taylor expansions replace the closed-form expressions of
+# logCoefficients, that suffer from cancellation for small angles.
+taylorThreshold = 1e-1
+
+def logCoefficients(theta):
+    """
+    Coefficients of the logarithm of SE(3) and of its Jacobian
+      - theta: numpy array of rotation angles.
+    return alpha, beta, beta_dot_over_theta where
+      alpha = theta sin(theta) / (2 (1 - cos(theta))),
+      beta  = 1/theta^2 - sin(theta) / (2 theta (1 - cos(theta))),
+      beta_dot_over_theta = beta'(theta) / theta.
+    """
+    t2 = theta**2
+    small = theta < taylorThreshold
+    t = np.where(small, 1., theta)
+    st = np.sin(t); ct = np.cos(t)
+    inv_2_2ct = 1./(2.*(1. - ct))
+    alpha = np.where(small, 1. - t2/12. - t2**2/720. - t2**3/30240.,
+                     t*st*inv_2_2ct)
+    beta = np.where(small, 1./12. + t2/720. + t2**2/30240. + t2**3/1209600.,
+                    1./t**2 - st*inv_2_2ct/t)
+    beta_dot_over_theta = np.where \
+        (small, 1./360. + t2/7560. + t2**2/201600.,
+         -2./t**4 + (1. + st/t)*inv_2_2ct/t**2)
+    return alpha, beta, beta_dot_over_theta
+
+def log3Batch(R):
+    """
+    Logarithm of a batch of rotation matrices
+      - R: numpy array of dimension (M,3,3)
+    return w, theta where w of dimension (M,3) and theta = ||w|| of
+    dimension (M,)
+    """
+    vee = np.stack((R[:,2,1] - R[:,1,2], R[:,0,2] - R[:,2,0],
+                    R[:,1,0] - R[:,0,1]), axis=-1)
+    s = .5*norm(vee, axis=-1)
+    c = .5*(np.trace(R, axis1=-2, axis2=-1) - 1)
+    theta = np.arctan2(s, c)
+    # theta / (2 sin(theta))
+    small = theta < taylorThreshold
+    k = np.where(small, .5*(1. + theta**2/6. + 7*theta**4/360.),
+                 .5*theta/np.where(small, 1., s))
+    w = k[:,None]*vee
+    # Close to pi, (R - R^T) vanishes: use the symmetric part of R instead.
+    big = theta > np.pi - 1e-2
+    if np.any(big):
+        tb = theta[big]
+        ct = c[big][:,None]
+        d = np.diagonal(R[big], axis1=-2, axis2=-1)
+        axis = np.sqrt(np.clip((d - ct)/(1 - ct), 0, None))
+        axis *= np.where(vee[big] < 0, -1., 1.)
+        w[big] = tb[:,None]*axis
+    return w, theta
+
+def log6Batch(R, p):
+    """
+    Logarithm of a batch of rigid-body transformations
+      - R: numpy array of dimension (M,3,3), rotation parts,
+      - p: numpy array of dimension (M,3), translation parts.
+    return nu, w, theta where nu of dimension (M,6) is (v,omega) as in
+    pinocchio.log6, w = omega and theta = ||omega||.
+    """
+    w, theta = log3Batch(R)
+    alpha, beta, _ = logCoefficients(theta)
+    wTp = np.einsum('ij,ij->i', w, p)
+    nu = np.empty((len(R), 6))
+    nu[:,0:3] = alpha[:,None]*p - .5*np.cross(w, p) + (beta*wTp)[:,None]*w
+    nu[:,3:6] = w
+    return nu, w, theta
+
+def Jlog6Batch(p, w, theta):
+    """
+    Jacobian of log6 for a batch of rigid-body transformations, as
+    pinocchio.Jlog6
+      - p: numpy array of dimension (M,3), translation parts,
+      - w, theta: output of log3Batch applied to the rotation parts.
+    return numpy array of dimension (M,6,6)
+    """
+    alpha, beta, beta_dot_over_theta = logCoefficients(theta)
+    I3 = np.eye(3)
+    # Jlog3 = alpha I + beta w w^T + 1/2 [w]_x
+    A = alpha[:,None,None]*I3 + beta[:,None,None]*w[:,:,None]*w[:,None,:] \
+        + .5*skew(w)
+    wTp = np.einsum('ij,ij->i', w, p)
+    v3 = (beta_dot_over_theta*wTp)[:,None]*w - \
+         (theta**2*beta_dot_over_theta + 2*beta)[:,None]*p
+    C = v3[:,:,None]*w[:,None,:] + beta[:,None,None]*w[:,:,None]*p[:,None,:]
+    C += (wTp*beta)[:,None,None]*I3 + skew(.5*p)
+    J = np.zeros((len(p), 6, 6))
+    J[:,0:3,0:3] = A
+    J[:,0:3,3:6] = np.matmul(C, A)
+    J[:,3:6,3:6] = A
+    return J
+
+def exp6Batch(nu):
+    """
+    Exponential of a batch of spatial velocities, as pinocchio.exp6
+      - nu: numpy array of dimension (M,6), (v,omega).
+    return R, p of dimensions (M,3,3) and (M,3)
+    """
+    v = nu[:,0:3]; w = nu[:,3:6]
+    theta = norm(w, axis=-1)
+    t2 = theta**2
+    small = theta < taylorThreshold
+    t = np.where(small, 1., theta)
+    st = np.sin(t); ct = np.cos(t)
+    # sin(theta)/theta, (1 - cos(theta))/theta^2, (theta - sin(theta))/theta^3
+    a = np.where(small, 1. - t2/6. + t2**2/120. - t2**3/5040., st/t)
+    b = np.where(small, .5 - t2/24. + t2**2/720. - t2**3/40320.,
+                 (1. - ct)/t**2)
+    c = np.where(small, 1./6. - t2/120. + t2**2/5040. - t2**3/362880.,
+                 (t - st)/t**3)
+    K = skew(w)
+    K2 = np.matmul(K, K)
+    R = np.eye(3) + a[:,None,None]*K + b[:,None,None]*K2
+    wv = np.cross(w, v)
+    p = v + b[:,None]*wv + c[:,None]*np.cross(w, wv)
+    return R, p
+
+def retractBatch(R, p, nu):
+    """
+    Move a batch of rigid-body transformations T along spatial velocities
+    expressed in the local frame: T exp6(nu)
+      - R, p: numpy arrays of dimensions (M,3,3) and (M,3),
+      - nu: numpy array of dimension (M,6), (v,omega).
+    return R, p of the resulting transformations
+    """
+    Re, pe = exp6Batch(nu)
+    return np.matmul(R, Re), p + np.einsum('mij,mj->mi', R, pe)
+
+def actionMatrixBatch(R, p):
+    """
+    Action matrices of a batch of rigid-body transformations, with the
+    (linear, angular) ordering of pinocchio
+      - R: numpy array of dimension (...,3,3), rotation parts,
+      - p: numpy array of dimension (...,3), translation parts.
+    """
+    X = np.zeros(R.shape[:-2] + (6,6))
+    X[...,0:3,0:3] = R
+    X[...,0:3,3:6] = np.matmul(skew(p), R)
+    X[...,3:6,3:6] = R
+    return X
+
+def rotationBatch(axis, q):
+    """
+    Rotations of angles q around a fixed axis (Rodrigues formula)
+      - axis: unit vector of dimension 3,
+      - q: numpy array of dimension (M,)
+    return numpy array of dimension (M,3,3)
+    """
+    K = skew(np.asarray(axis, dtype=float))
+    K2 = K.dot(K)
+    return np.eye(3) + np.sin(q)[:,None,None]*K + \
+        (1 - np.cos(q))[:,None,None]*K2
+
+class BatchKinematics(object):
+    """
+    Forward kinematics and joint Jacobians of a few joints of a model,
+    computed for a batch of configurations at once.
+
+    Only the joints supporting the requested joints are evaluated. All the
+    joints in the supports must be revolute.
+      - model: pinocchio model,
+      - joints: names of the joints the configuration of which is provided
+                to compute. Other joints are kept at their neutral value,
+      - frames: names of the joints the placement and Jacobian of which are
+                computed.
+    """
+    def __init__(self, model, joints, frames):
+        data = model.createData()
+        q0 = neutral(model)
+        forwardKinematics(model, data, q0)
+        computeJointJacobians(model, data, q0)
+        self.frameIds = [model.getJointId(f) for f in frames]
+        jointIds = [model.getJointId(j) for j in joints]
+        # joints to evaluate, in topological order
+        chain = set()
+        for i in self.frameIds:
+            chain.update(model.supports[i])
+        chain.discard(0)
+        self.chain = sorted(chain)
+        self.parent = dict()
+        self.placement = dict()
+        self.axis = dict()
+        self.neutral = dict()
+        # column of each joint in the input batch of configurations
+        self.column = dict()
+        for i in self.chain:
+            jmodel = model.joints[i]
+            if jmodel.nq != 1 or jmodel.nv != 1:
+                raise RuntimeError('joint {} is not revolute'.format
+                                   (model.names[i]))
+            # Motion subspace of the joint expressed in the joint frame
+            S = getJointJacobian(model, data, i, ReferenceFrame.LOCAL) \
+                [:,jmodel.idx_v]
+            if norm(S[0:3]) > 1e-12:
+                raise RuntimeError('joint {} is not revolute'.format
+                                   (model.names[i]))
+            self.parent[i] = model.parents[i]
+            M = model.jointPlacements[i]
+            self.placement[i] = (np.array(M.rotation),
+                                 np.array(M.translation).reshape(3))
+            self.axis[i] = np.array(S[3:6]).reshape(3)
+            self.neutral[i] = q0[jmodel.idx_q]
+        for c, i in enumerate(jointIds):
+            if i in self.neutral:
+                self.column[i] = c
+        self.jointIds = jointIds
+
+    def compute(self, q):
+        """
+        Compute placements and Jacobians
+          - q: numpy array of dimension (M,nj) where nj is the number of
+               joints provided to the constructor.
+        return R, p, J where R[f] (M,3,3), p[f] (M,3) are the placement of
+        frame f and J[f] (M,6,nj) the Jacobian of frame f expressed in
+        frame f (ReferenceFrame.LOCAL), with respect to the joints provided
+        to the constructor.
+        """
+        M = len(q)
+        R = {0: np.broadcast_to(np.eye(3), (M,3,3))}
+        p = {0: np.zeros((M,3))}
+        for i in self.chain:
+            c = self.column.get(i)
+            qi = q[:,c] if c is not None else np.full(M, self.neutral[i])
+            Rp, pp = R[self.parent[i]], p[self.parent[i]]
+            Rl, pl = self.placement[i]
+            R[i] = np.matmul(np.matmul(Rp, Rl), rotationBatch(self.axis[i],
+                                                                qi))
+            p[i] = pp + np.matmul(Rp, pl)
+        Rf = dict(); pf = dict(); Jf = dict()
+        nj = len(self.jointIds)
+        for f in self.frameIds:
+            Rf[f] = R[f]; pf[f] = p[f]
+            J = np.zeros((M, 6, nj))
+            RfT = np.swapaxes(R[f], 1, 2)
+            for c, i in enumerate(self.jointIds):
+                if i not in self.column or not self._supports(i, f):
+                    continue
+                # axis of joint i in world frame
+                a = np.matmul(R[i], self.axis[i])
+                J[:,3:6,c] = np.einsum('mij,mj->mi', RfT, a)
+                J[:,0:3,c] = np.einsum('mij,mj->mi', RfT,
+                                       np.cross(p[i] - p[f], a))
+            Jf[f] = J
+        return Rf, pf, Jf
+
+    def _supports(self, i, f):
+        while f != 0:
+            if f == i: return True
+            f = self.parent[f]
+        return False
+
+def robustWeights(loss, errors, scale):
+    """
+    Weights of iteratively reweighted least squares for a robust loss
+      - loss: None (least squares), 'huber' or 'cauchy',
+      - errors: numpy array of norms of the residual blocks,
+      - scale: positive scale of the loss.
+    """
+    if loss is None:
+        return np.ones(len(errors))
+    if not scale > 0:
+        raise ValueError('scale of the loss should be positive, got {}'.
+                         format(scale))
+    r = errors/scale
+    if loss == 'huber':
+        return np.where(r <= 1, 1., 1./np.maximum(r, 1))
+    if loss == 'cauchy':
+        return 1./(1. + r**2)
+    raise ValueError('unknown loss "{}", expecting "huber" or "cauchy"'.
+                     format(loss))
+
+# Reduced models already built, indexed by URDF file and kept joints
+_reducedModels = dict()
+
+def loadReducedModel(urdfFilename, joints):
+    """
+    Kinematic model of a robot restricted to the chains from the root to the
+    given joints
+
+    The other joints are locked at their neutral value. Models are cached,
+    so that the URDF file is parsed once per process.
+    """
+    key = (os.path.abspath(urdfFilename), os.path.getmtime(urdfFilename),
+           tuple(joints))
+    if key not in _reducedModels:
+        model = buildModelFromUrdf(urdfFilename)
+        kept = set()
+        for j in joints:
+            kept.update(model.supports[model.getJointId(j)])
+        locked = [i for i in range(1, model.njoints) if not i in kept]
+        _reducedModels[key] = buildReducedModel(model, locked, neutral(model))
+    return _reducedModels[key]
 
 class Variable(object):
     """
@@ -108,25 +360,87 @@ class Variable(object):
         self.lwTls = lwTls
         self.rwTrs = rwTrs
 
-class SE3Integrator (object):
+    def supports(self):
+        """
+        Positions of the supports in the wrists, in the order of the
+        columns of the Jacobian
+        """
+        return [self.lwTls, self.rwTrs]
+
+    def setSupports(self, supports):
+        self.lwTls, self.rwTrs = supports
+
+    def supportNames(self):
+        return ['lwTls', 'rwTrs']
+
+    def copy(self):
+        return Variable(self.q_off.copy(), SE3(self.hTc), SE3(self.lwTls),
+                        SE3(self.rwTrs))
+
+class MultiSessionVariable(Variable):
     """
-    Integrate a velocity on SE3
+    Optimization variable of the calibration problem over several sessions.
+
+    Joint offsets q_off and camera position hTc are shared by all sessions.
+    Since the supports are mounted again before each session, lwTls and
+    rwTrs are lists with one position per session.
     """
-    def __init__(self):
-        self.model = Model()
-        self.model.addJoint(0, JointModelFreeFlyer(), SE3(), "SE3")
+    def supports(self):
+        return [T for lr in zip(self.lwTls, self.rwTrs) for T in lr]
+
+    def setSupports(self, supports):
+        self.lwTls = supports[0::2]
+        self.rwTrs = supports[1::2]
+
+    def supportNames(self):
+        return ['{}[{}]'.format(n, i) for i in range(len(self.lwTls))
+                for n in ['lwTls', 'rwTrs']]
 
+    def copy(self):
+        return MultiSessionVariable(self.q_off.copy(), SE3(self.hTc),
+                                    [SE3(T) for T in self.lwTls],
+                                    [SE3(T) for T in self.rwTrs])
+
+    def resize(self, nSessions):
+        """
+        Set the number of sessions, new sessions are initialized with the
+        supports of the last one.
+        """
+        while len(self.lwTls) < nSessions:
+            self.lwTls.append(SE3(self.lwTls[-1]))
+            self.rwTrs.append(SE3(self.rwTrs[-1]))
+        del self.lwTls[nSessions:], self.rwTrs[nSessions:]
+
+class SE3Retraction(object):
+    """
+    Integrate a velocity on SE3: T exp6(nu), as pinocchio.integrate on a
+    free-flyer joint
+    """
     def __call__(self, T, nu):
         """
         Integrate se3 velocity from SE3 element T
           - T: instance of SE3
           - nu: numpy array of dimension 6 (v,omega)
         """
-        q0 = np.array(7*[0.])
-        q0[0:3] = T.translation
-        q0[3:7] = Quaternion(T.rotation).coeffs()
-        q = integrate(self.model,q0,nu)
-        return SE3(Quaternion(x=q[3], y=q[4], z=q[5], w=q[6]), q[0:3])
+        return T*exp6(np.reshape(nu, 6))
+
+    def batch(self, transforms, nu):
+        """
+        Integrate velocities from several SE3 elements
+          - transforms: list of SE3 instances,
+          - nu: numpy array of dimension (len(transforms),6).
+        return list of SE3 instances
+
+        The transformations are stacked in arrays and integrated at once by
+        retractBatch.
+        """
+        nu = np.reshape(nu, (-1,6))
+        if len(transforms) == 0:
+            return list()
+        R = np.array([T.rotation for T in transforms])
+        p = np.array([T.translation for T in transforms]).reshape(-1,3)
+        R, p = retractBatch(R, p, nu)
+        return [SE3(Ri, pi) for Ri, pi in zip(R, p)]
 
 class ComputeCalibration(object):
     # List of joints between the wrists and the camera.
@@ -142,95 +456,269 @@ class ComputeCalibration(object):
     lwJoint = 'arm_left_7_joint'
     rwJoint = 'arm_right_7_joint'
     eps = 1
+    # Parameters of solveLevenbergMarquardt
+    #  - initial damping, relative to the diagonal of the normal matrix,
+    #  - the solver stops when the norm of the step or the relative decrease
+    #    of the cost gets below the following tolerances.
+    damping = 1e-3
+    stepTolerance = 1e-10
+    costTolerance = 1e-12
+    # Robust loss used by solveRobust: None, 'huber' or 'cauchy'. The scale
+    # of the loss is lossScale if not None, lossScaleFactor times the median
+    # of the measurement errors otherwise, and at least minLossScale, so that
+    # the weights are defined when most errors are zero. Measurements with an
+    # error above rejectionThreshold times the scale are flagged as outliers.
+    loss = 'huber'
+    lossScale = None
+    lossScaleFactor = 2.
+    minLossScale = 1e-9
+    rejectionThreshold = 3.
+    # Whether solvers print their progress
+    verbose = True
+    # Whether computeValueAndJacobian processes all measurements at once
+    # (see computeValueAndJacobianBatch) or one after the other.
+    vectorized = True
+    # Number of measurements processed at once and number of threads used
+    # by computeValueAndJacobianBatch
+    blockSize = 256
+    nThreads = cpu_count()
     def __init__(self, urdfFilename, variable):
-        self.cols = len(self.joints) + 3*6
+        # q_off, hTc and the supports (see Variable.supports)
+        self.cols = len(self.joints) + 6 + 6*len(variable.supports())
+        self.pool = None
+        self.urdfFilename = urdfFilename
+        self.dataFiles = list()
         # warning, there is no root joint
-        # self.robot.model.joints[i].idx_v gives the index of the column of
+        # Only the chains from the torso to the head and to the wrists are
+        # kept in the model, other joints are locked at their neutral value.
+        # self.model.joints[i].idx_v gives the index of the column of
         # the Jacobian corresponding to joint i
-        # cc.robot.model.names[i] gives the name of joint i.
-        self.robot = RobotWrapper.BuildFromURDF(urdfFilename)
+        # cc.model.names[i] gives the name of joint i.
+        self.model = loadReducedModel(urdfFilename,
+            [self.headJoint, self.lwJoint, self.rwJoint])
+        self.data = self.model.createData()
         # record head and wrist indices in model
-        self.headId = self.robot.model.getJointId(self.headJoint)
-        self.lwId = self.robot.model.getJointId(self.lwJoint)
-        self.rwId = self.robot.model.getJointId(self.rwJoint)
-        assert(self.robot.model.names[self.headId] == self.headJoint)
-        assert(self.robot.model.names[self.lwId] == self.lwJoint)
-        assert(self.robot.model.names[self.rwId] == self.rwJoint)
-        self.measurements = list()
+        self.headId = self.model.getJointId(self.headJoint)
+        self.lwId = self.model.getJointId(self.lwJoint)
+        self.rwId = self.model.getJointId(self.rwJoint)
+        assert(self.model.names[self.headId] == self.headJoint)
+        assert(self.model.names[self.lwId] == self.lwJoint)
+        assert(self.model.names[self.rwId] == self.rwJoint)
+        self.kinematics = BatchKinematics(self.model, self.joints,
+            [self.headJoint, self.lwJoint, self.rwJoint])
+        self.measurements = None
         self.variable = variable
-        self.integrate = SE3Integrator()
+        self.integrate = SE3Retraction()
+        # time and errors of the iterations of the solvers
+        self.telemetry = Telemetry()
         # allocate constant matrices
         self.Jh = np.array(6*[len(self.joints)*[0.]])
         self.Jw = np.array(6*[len(self.joints)*[0.]])
 
     def readData(self, filename):
-        jointNamesRead = False
-        with open(filename, 'r') as f:
-            r = reader(f)
-            for i, line in enumerate(r):
-                if not jointNamesRead:
-                    if line [0] != 'joint_names':
-                        raise SyntaxError \
-                       ('expecting tag "joint_names" in first line, got "{}"'
-                             .format(line [0]))
-                    self.allJoints = line [1:]
-                    jointNamesRead = True
-                else:
-                    self.measurements.append(parseLine(line, i))
+        """
+        Add measurements read in a CSV file or in a directory of arrays
+        written by measurements.py
+        """
+        measurements = Measurements.read(filename)
+        self.dataFiles.append(filename)
+        if self.measurements is None:
+            self.measurements = measurements
+        else:
+            self.measurements = Measurements.concatenate \
+                ([self.measurements, measurements])
+        self.allJoints = self.measurements.jointNames
+        self.prepareVariable()
+        self.cols = len(self.joints) + 6 + 6*len(self.variable.supports())
         # Allocate value and Jacobian
-        self.value = np.array(6*len(self.measurements)*[0.])
-        self.value.shape =(6*len(self.measurements),1)
-        self.jacobian = np.array(6*len(self.measurements)*self.cols*[0.])
-        self.jacobian.shape =(6*len(self.measurements), self.cols)
+        self.value = np.zeros((6*len(self.measurements),1))
+        self.jacobian = np.zeros((6*len(self.measurements), self.cols))
         # Compute list of joint indices
         #  - measurementIndices indices of self.joints in configurations of
         #     measurements,
-        #  - modelQIndices indices of self.joints in self.robot.model
+        #  - modelQIndices indices of self.joints in self.model
         #     configurations
-        #  - modelVIndices indices of self.joints in self.robot.model
+        #  - modelVIndices indices of self.joints in self.model
         #     velocities.
         self.measurementIndices = list()
         self.modelQIndices = list()
         self.modelVIndices = list()
-        model = self.robot.model
+        model = self.model
         for j in self.joints:
             i = model.getJointId(j)
             self.modelQIndices.append(model.joints[i].idx_q)
             self.modelVIndices.append(model.joints[i].idx_v)
             self.measurementIndices.append(self.allJoints.index(j))
-        
+        self.stackMeasurements()
+
+    def prepareVariable(self):
+        """
+        Adapt self.variable to the measurements read by readData
+        """
+        pass
+
+    def stackMeasurements(self):
+        """
+        Store the measurements in arrays used by computeValueAndJacobianBatch
+          - self.q_meas (M,nj): measured values of self.joints,
+          - self.left (M,): whether the measurement is on the left gripper,
+          - self.meas_R (M,3,3), self.meas_p (M,3): measured pose of the
+            support in the camera frame,
+          - self.supportIndex (M,): index of the measured support in
+            self.variable.supports().
+        """
+        m = self.measurements
+        M = len(self.measurements)
+        self.q_meas = m.jointStates [:,self.measurementIndices]
+        self.left = m.left
+        self.meas_R = m.rotations()
+        self.meas_p = m.translations()
+        self.supportIndex = np.where(self.left, 0, 1)
+        # weights of the measurements in the least squares problem
+        self.weights = np.ones(M)
+        self.rejected = np.zeros(M, dtype=bool)
+
     def computeValueAndJacobian(self):
-        model = self.robot.model; data = self.robot.data
+        if self.vectorized:
+            self.computeValueAndJacobianBatch()
+        else:
+            self.computeValueAndJacobianSerial()
+
+    def computeValueAndJacobianBatch(self):
+        """
+        Compute self.value and self.jacobian for all measurements at once
+
+        Only the kinematic chains from the torso to the head and to the
+        wrists are evaluated (see BatchKinematics). Measurements are split
+        in blocks of self.blockSize rows processed by self.nThreads threads.
+        """
+        M = len(self.measurements)
+        blocks = [(b, min(b + self.blockSize, M))
+                  for b in range(0, M, self.blockSize)]
+        if self.nThreads > 1 and len(blocks) > 1:
+            if self.pool is None:
+                self.pool = ThreadPool(self.nThreads)
+            self.pool.map(lambda block: self.computeBlock(*block), blocks)
+        else:
+            for block in blocks:
+                self.computeBlock(*block)
+
+    def computeBlock(self, begin, end):
+        """
+        Compute rows of self.value and self.jacobian relative to
+        measurements begin to end - 1
+        """
+        nj = len(self.joints); M = end - begin
+        t0 = time.time()
+        R, p, J = self.kinematics.compute \
+            (self.q_meas[begin:end] + self.variable.q_off.reshape(1,nj))
+        t1 = time.time()
+        self.telemetry.add('kinematics', t1 - t0)
+        left = self.left[begin:end]
+        l3 = left[:,None]; l33 = left[:,None,None]
+        # position and Jacobian of the head and of the measured wrist
+        Rh, ph, Jh = R[self.headId], p[self.headId], J[self.headId]
+        Rw = np.where(l33, R[self.lwId], R[self.rwId])
+        pw = np.where(l3, p[self.lwId], p[self.rwId])
+        Jw = np.where(l33, J[self.lwId], J[self.rwId])
+        # position of the support in the wrist
+        supports = self.variable.supports()
+        k = self.supportIndex[begin:end]
+        Rs = np.array([T.rotation for T in supports])[k]
+        ps = np.array([np.array(T.translation).reshape(3)
+                       for T in supports])[k]
+        # hTw = Th^{-1} Tw
+        RhT = np.swapaxes(Rh, 1, 2)
+        R_hw = np.matmul(RhT, Rw)
+        p_hw = np.einsum('mij,mj->mi', RhT, pw - ph)
+        # cTs = hTc^{-1} hTw wTs
+        hTc = self.variable.hTc
+        RcT = np.array(hTc.rotation).T
+        pc = np.array(hTc.translation).reshape(3)
+        R_cs = np.matmul(RcT, np.matmul(R_hw, Rs))
+        p_cs = np.einsum('ij,mj->mi', RcT,
+                         np.einsum('mij,mj->mi', R_hw, ps) + p_hw - pc)
+        # valueSE3 = meas_cTs^{-1} cTs
+        meas_RT = np.swapaxes(self.meas_R[begin:end], 1, 2)
+        R_v = np.matmul(meas_RT, R_cs)
+        p_v = np.einsum('mij,mj->mi', meas_RT, p_cs - self.meas_p[begin:end])
+        value, w, theta = log6Batch(R_v, p_v)
+        Jlog = Jlog6Batch(p_v, w, theta)
+        self.value[6*begin:6*end,0] = value.reshape(6*M)
+        # Compute Jacobian
+        jacobian = self.jacobian[6*begin:6*end].reshape(M, 6, self.cols)
+        R_hwT = np.swapaxes(R_hw, 1, 2)
+        wXh = actionMatrixBatch(R_hwT, -np.einsum('mij,mj->mi', R_hwT, p_hw))
+        RsT = np.swapaxes(Rs, 1, 2)
+        wXs_inv = actionMatrixBatch(RsT, -np.einsum('mij,mj->mi', RsT, ps))
+        R_csT = np.swapaxes(R_cs, 1, 2)
+        sXc = actionMatrixBatch(R_csT, -np.einsum('mij,mj->mi', R_csT, p_cs))
+        # columns relative to q_off
+        jacobian[:,:,0:nj] = np.matmul(np.matmul(Jlog, wXs_inv),
+                                       Jw - np.matmul(wXh, Jh))
+        # columns relative to hTc
+        jacobian[:,:,nj:nj+6] = -np.matmul(Jlog, sXc)
+        # columns relative to the supports: only the one of the measurement
+        # is non zero.
+        jacobian[:,:,nj+6:] = 0
+        cols = nj + 6 + 6*k[:,None] + np.arange(6)[None,:]
+        jacobian[np.arange(M)[:,None],:,cols] = np.swapaxes(Jlog, 1, 2)
+        self.telemetry.add('jacobian', time.time() - t1)
+
+    def evaluate(self, q_meas, left, meas_R, meas_p, supportIndex = None):
+        """
+        Compute the errors and Jacobians of measurements not stored in self
+          - q_meas (N,nj): measured values of self.joints,
+          - left (N,): whether the measurement is on the left gripper,
+          - meas_R (N,3,3), meas_p (N,3): measured pose of the support in the
+            camera frame,
+          - supportIndex (N,): index of the measured support in
+            self.variable.supports(), 0 for left and 1 for right by default.
+        return value (N,6) and jacobian (N,6,self.cols)
+        """
+        N = len(q_meas)
+        c = copy.copy(self)
+        c.telemetry = Telemetry()
+        c.q_meas = np.asarray(q_meas, dtype=float).reshape(N, -1)
+        c.left = np.asarray(left, dtype=bool).reshape(N)
+        c.supportIndex = np.where(c.left, 0, 1) if supportIndex is None \
+                         else np.asarray(supportIndex)
+        c.meas_R = meas_R; c.meas_p = meas_p
+        c.value = np.zeros((6*N,1))
+        c.jacobian = np.zeros((6*N, self.cols))
+        c.computeBlock(0, N)
+        return c.value.reshape(N,6), c.jacobian.reshape(N,6,self.cols)
+
+    def computeValueAndJacobianSerial(self):
+        model = self.model; data = self.data
         nj = len(self.joints)
-        for im, measurement in enumerate(self.measurements):
+        for im in range(len(self.measurements)):
             #                            ^
             # compute configuration q  = q  + q
             #                        i    i    off
             qi = neutral(model)
             for i in range(nj):
-                imeas = self.measurementIndices[i]
                 imodel = self.modelQIndices[i]
-                qi[imodel] = measurement['joint_states'][imeas] + \
-                             self.variable.q_off[i,0]
+                qi[imodel] = self.q_meas[im,i] + self.variable.q_off[i,0]
+            t0 = time.time()
             forwardKinematics(model, data, qi)
             computeJointJacobians(model, data)
+            t1 = time.time()
+            self.telemetry.add('kinematics', t1 - t0)
             # position of the head
             Th = data.oMi[self.headId]
             hTc = self.variable.hTc
-            if measurement.has_key('left_gripper'):
-                meas_cTs = measurement['left_gripper']
+            meas_cTs = SE3(self.meas_R[im], self.meas_p[im])
+            k = self.supportIndex[im]
+            wTs = self.variable.supports()[k]
+            if self.left[im]:
                 Tw = data.oMi[self.lwId]
-                wTs = self.variable.lwTls
                 Jw_full = getJointJacobian(model, data, self.lwId, \
                                            ReferenceFrame.LOCAL)
-                left = True
             else:
-                meas_cTs = measurement['right_gripper']
                 Tw = data.oMi[self.rwId]
-                wTs = self.variable.rwTrs
                 Jw_full = getJointJacobian(model, data, self.rwId, \
                                            ReferenceFrame.LOCAL)
-                left = False
             valueSE3 = meas_cTs.inverse()*hTc.inverse()*Th.inverse()*Tw*wTs
             value = log6(valueSE3)
             Jlog = Jlog6(valueSE3)
@@ -253,26 +741,201 @@ class ComputeCalibration(object):
                 Jlog.dot(wXs_inv).dot(-Xw_inv.dot(Xh).dot(self.Jh) + self.Jw)
             # columns relative to hTc
             self.jacobian[6*im+0:6*im+6,nj:nj+6] = -Jlog.dot(sXc)
-            # columns relative to lwTls and rwTrs
-            if left:
-                self.jacobian[6*im+0:6*im+6,nj+6: nj+12] = Jlog
-                self.jacobian[6*im+0:6*im+6,nj+12:nj+18] = np.zeros((6,6))
-            else:
-                self.jacobian[6*im+0:6*im+6,nj+6: nj+12] = np.zeros((6,6))
-                self.jacobian[6*im+0:6*im+6,nj+12:nj+18] = Jlog
+            # columns relative to the supports
+            self.jacobian[6*im+0:6*im+6,nj+6:] = 0
+            self.jacobian[6*im+0:6*im+6,nj+6+6*k:nj+12+6*k] = Jlog
+            self.telemetry.add('jacobian', time.time() - t1)
 
     def solve(self):
-        nj = len(self.joints)
         self.computeValueAndJacobian()
-        dy = - self.eps * pinv(self.jacobian).dot(self.value)
+        with self.telemetry.stage('solve'):
+            dy = - self.eps * pinv(self.jacobian).dot(self.value)
         print ("||dy|| = {}".format(norm(dy)))
-        self.variable.q_off += dy[0:nj]
-        hnuc = dy[nj:nj+6]
-        lwnuls = dy[nj+6:nj+12]
-        rwnurs = dy[nj+12:nj+18]
-        self.variable.hTc = self.integrate(self.variable.hTc, hnuc)
-        self.variable.lwTls = self.integrate(self.variable.lwTls, lwnuls)
-        self.variable.rwTrs = self.integrate(self.variable.rwTrs, rwnurs)
+        self.applyStep(dy)
+        self.telemetry.record(solver = 'gauss-newton',
+            errorNorm = norm(self.value), stepNorm = norm(dy),
+            **errorStatistics(self.measurementErrors()))
+
+    def solveLevenbergMarquardt(self, maxIterations = 100):
+        """
+        Minimize the norm of self.value with Levenberg-Marquardt algorithm
+
+        Each measurement error is weighted by self.weights.
+
+        Each step solves the normal equations
+          (J^T J + lambda diag(J^T J)) dy = - J^T value
+        of dimension self.cols, so that the cost of an iteration is linear
+        in the number of measurements. The damping lambda is adapted to the
+        ratio between the actual and the predicted decrease of the cost.
+        Stops when the step norm is below self.stepTolerance, when the
+        relative decrease of the cost is below self.costTolerance, or after
+        maxIterations iterations.
+
+        return a dictionary with keys 'iterations', 'cost', 'converged' and
+        'time' (wall time in seconds).
+        """
+        t0 = time.time()
+        self.computeValueAndJacobian()
+        sw = np.repeat(np.sqrt(self.weights), 6).reshape(-1,1)
+        cost = .5*norm(sw*self.value)**2
+        lam = self.damping; nu = 2.
+        converged = False
+        upToDate = True
+        # number of iterations is iteration + 1, 0 if maxIterations is 0
+        iteration = -1
+        for iteration in range(maxIterations):
+            if upToDate:
+                J = sw*self.jacobian
+                JtJ = J.T.dot(J)
+                g = J.T.dot(sw*self.value)
+                d = np.maximum(np.diag(JtJ), 1e-12)
+            with self.telemetry.stage('solve'):
+                try:
+                    dy = -np.linalg.solve(JtJ + lam*np.diag(d), g)
+                except np.linalg.LinAlgError:
+                    dy = -np.linalg.lstsq(JtJ + lam*np.diag(d), g,
+                                          rcond=-1)[0]
+            predicted = -(g.T.dot(dy) + .5*dy.T.dot(JtJ).dot(dy))[0,0]
+            previous = self.variable.copy()
+            self.applyStep(dy)
+            self.computeValueAndJacobian()
+            newCost = .5*norm(sw*self.value)**2
+            self.telemetry.record(solver = 'lm', iteration = iteration,
+                cost = newCost, errorNorm = norm(self.value),
+                stepNorm = norm(dy), damping = lam,
+                accepted = bool(newCost < cost),
+                **errorStatistics(self.measurementErrors()))
+            if newCost < cost:
+                rho = (cost - newCost)/predicted if predicted > 0 else 0.
+                lam *= max(1./3, 1 - (2*rho - 1)**3); nu = 2.
+                decrease = cost - newCost
+                cost = newCost
+                upToDate = True
+                if self.verbose:
+                    print ("iteration {}: ||error|| = {}, ||dy|| = {}, "
+                           "lambda = {}".format(iteration, norm(self.value),
+                                                norm(dy), lam))
+                if norm(dy) < self.stepTolerance or \
+                   decrease < self.costTolerance*cost:
+                    converged = True
+                    break
+            else:
+                self.variable = previous
+                lam *= nu; nu *= 2.
+                upToDate = False
+                if norm(dy) < self.stepTolerance:
+                    converged = True
+                    break
+        if not upToDate:
+            self.computeValueAndJacobian()
+        report = dict(iterations = iteration + 1, cost = cost,
+                      converged = converged, time = time.time() - t0)
+        if self.verbose:
+            print ("{} after {} iterations in {:.3f} s, ||error|| = {}".format
+                   ("converged" if converged else "not converged",
+                    report['iterations'], report['time'], norm(self.value)))
+        return report
+
+    def solveRobust(self, maxReweightings = 20, maxIterations = 100):
+        """
+        Minimize the robust loss self.loss of the measurement errors
+
+        The measurements are reweighted according to their errors (see
+        robustWeights) and the weighted problem is solved by
+        solveLevenbergMarquardt, until the weights do not change anymore.
+        Measurements with an error above self.rejectionThreshold times the
+        scale of the loss are flagged in self.rejected.
+
+        return the report of the last call to solveLevenbergMarquardt, where
+        'iterations' and 'time' are the totals over all calls, with
+        additional keys 'reweightings', 'scale' and 'rejected'. If
+        maxReweightings is 0, the problem is not solved and the report
+        describes the current variable.
+        """
+        t0 = time.time()
+        self.computeValueAndJacobian()
+        sw = np.repeat(np.sqrt(self.weights), 6).reshape(-1,1)
+        report = dict(iterations = 0, cost = .5*norm(sw*self.value)**2,
+                      converged = False)
+        iterations = 0
+        reweightings = 0
+        for reweighting in range(maxReweightings):
+            errors = self.measurementErrors()
+            scale = self.robustScale(errors)
+            weights = robustWeights(self.loss, errors, scale)
+            if reweighting > 0 and \
+               np.max(np.abs(weights - self.weights)) < 1e-3:
+                break
+            self.weights = weights
+            self.telemetry.tags['reweighting'] = reweighting
+            report = self.solveLevenbergMarquardt(maxIterations)
+            iterations += report['iterations']
+            reweightings = reweighting + 1
+        self.telemetry.tags.pop('reweighting', None)
+        # errors of the final variable
+        errors = self.measurementErrors()
+        scale = self.robustScale(errors)
+        report.update(iterations = iterations, time = time.time() - t0)
+        self.rejected = errors > self.rejectionThreshold*scale
+        report.update(reweightings = reweightings, scale = scale,
+                      rejected = np.flatnonzero(self.rejected).tolist())
+        if self.verbose:
+            print ("{} measurement(s) rejected: {}".format
+                   (len(report['rejected']), report['rejected']))
+        return report
+
+    def robustScale(self, errors):
+        """
+        Scale of the robust loss for the given measurement errors
+        """
+        scale = self.lossScale if self.lossScale is not None else \
+            self.lossScaleFactor*np.median(errors)
+        return max(scale, self.minLossScale)
+
+    def parameterNames(self):
+        """
+        Names of the parameters corresponding to the columns of the Jacobian
+        """
+        names = list(self.joints)
+        for T in ['hTc'] + self.variable.supportNames():
+            names += [T + '.' + c for c in ['vx', 'vy', 'vz', 'wx', 'wy', 'wz']]
+        return names
+
+    def measurementErrors(self):
+        """
+        Norms of the errors of the measurements stored in self.value
+        """
+        return norm(self.value.reshape(-1,6), axis=1)
+
+    def writeOutlierReport(self, filename):
+        """
+        Write in CSV format, for each measurement, the line in the data file,
+        the gripper, the norm of the error, the weight and whether the
+        measurement is rejected as an outlier.
+        """
+        errors = self.measurementErrors()
+        with open(filename, 'w') as f:
+            w = writer(f)
+            w.writerow(['line', 'gripper', 'error', 'weight', 'rejected'])
+            for im in range(len(self.measurements)):
+                w.writerow([self.measurements.lines[im],
+                            'left' if self.left[im] else 'right',
+                            errors[im], self.weights[im],
+                            int(self.rejected[im])])
+
+    def applyStep(self, dy):
+        """
+        Update self.variable by a step dy of dimension self.cols
+        """
+        nj = len(self.joints)
+        with self.telemetry.stage('integration'):
+            self.variable.q_off += dy[0:nj]
+            # hTc and the supports are updated at once
+            transforms = self.integrate.batch \
+                ([self.variable.hTc] + self.variable.supports(),
+                 dy[nj:].reshape(-1,6))
+            self.variable.hTc = transforms[0]
+            self.variable.setSupports(transforms[1:])
 
     def testJacobian(self):
         # Derivatives with respect to q_off
@@ -306,46 +969,35 @@ class ComputeCalibration(object):
             error = (v1 - v0)/(2*dq) - J[:,nj+i:nj+i+1]
             print ("||error|| = {}".format(norm(error)))
         self.variable.hTc = hTc0
-        # Derivatives with respect to lwTls
-        lwTls0 = SE3(self.variable.lwTls)
-        for i in range(6):
-            nu = np.zeros((6,1))
-            nu[i] = -dq
-            self.variable.lwTls = self.integrate(lwTls0, nu)
-            self.computeValueAndJacobian()
-            v0 = self.value.copy()
-            nu[i] = dq
-            self.variable.lwTls = self.integrate(lwTls0, nu)
-            self.computeValueAndJacobian()
-            v1 = self.value.copy()
-            error = (v1 - v0)/(2*dq) - J[:,nj+6+i:nj+6+i+1]
-            print ("||error|| = {}".format(norm(error)))
-        self.variable.lwTls = lwTls0
-        # Derivatives with respect to rwTrs
-        rwTrs0 = SE3(self.variable.rwTrs)
-        for i in range(6):
-            nu = np.zeros((6,1))
-            nu[i] = -dq
-            self.variable.rwTrs = self.integrate(rwTrs0, nu)
-            self.computeValueAndJacobian()
-            v0 = self.value.copy()
-            nu[i] = dq
-            self.variable.rwTrs = self.integrate(rwTrs0, nu)
-            self.computeValueAndJacobian()
-            v1 = self.value.copy()
-            error = (v1 - v0)/(2*dq) - J[:,nj+12+i:nj+12+i+1]
-            print ("||error|| = {}".format(norm(error)))
-        self.variable.rwTrs = rwTrs0
+        # Derivatives with respect to the supports
+        supports0 = [SE3(T) for T in self.variable.supports()]
+        for k, T0 in enumerate(supports0):
+            supports = list(supports0)
+            for i in range(6):
+                nu = np.zeros((6,1))
+                nu[i] = -dq
+                supports[k] = self.integrate(T0, nu)
+                self.variable.setSupports(supports)
+                self.computeValueAndJacobian()
+                v0 = self.value.copy()
+                nu[i] = dq
+                supports[k] = self.integrate(T0, nu)
+                self.variable.setSupports(supports)
+                self.computeValueAndJacobian()
+                v1 = self.value.copy()
+                c = nj+6+6*k+i
+                error = (v1 - v0)/(2*dq) - J[:,c:c+1]
+                print ("||error|| = {}".format(norm(error)))
+        self.variable.setSupports(supports0)
 
-    def write_xacro(self):
-        import itertools
+    def write_xacro(self, f = sys.stdout):
         # The xacro file contains:
         # - the relative transform from head_2_link to rgbd_link, under camera_position_[xyz] and camera_orientation_[rpy] variables.
         # - the joint offsets, under variables <joint_name>_offset
         # Compute camera pose
         # hTc: head_2_joint (a) to rgbd_rgb_optical_frame (d)
         # desired: head_2_link (b) to rgbd_link (c)
-        model = self.robot.model
+        model = self.model
         head_2_link = model.frames[model.getFrameId("head_2_link")]
         rgbd_rgb_optical_frame = model.frames[model.getFrameId("rgbd_rgb_optical_frame")]
         rgbd_link = model.frames[model.getFrameId("rgbd_link")]
@@ -359,13 +1011,14 @@ class ComputeCalibration(object):
 
         bMc = aMb.inverse() * aMd * cMd.inverse()
         xacro_property = """<xacro:property name="{}" value="{}" />"""
+        xacro_property = xacro_property + "\n"
         for s, v in zip('xyz', bMc.translation):
-            print(xacro_property.format("camera_position_"+s, v))
+            f.write(xacro_property.format("camera_position_"+s, v))
         for s, v in zip('rpy', pinocchio.rpy.matrixToRpy(bMc.rotation).ravel()):
-            print(xacro_property.format("camera_orientation_"+s, v))
+            f.write(xacro_property.format("camera_orientation_"+s, v))
 
         for jn, v in zip(self.joints, self.variable.q_off.ravel()):
-            print(xacro_property.format(jn+"_offset", -v))
+            f.write(xacro_property.format(jn+"_offset", -v))
 
     def histogram(self):
         # Build and display an histogram of the measurement errors stored
@@ -379,10 +1032,29 @@ class ComputeCalibration(object):
         axs.hist(self.errors, bins=20)
         fig.show()
 
-if __name__ == '__main__':
-    filename = os.getenv('DEVEL_HPP_DIR') + \
-               '/install/share/talos_data/urdf/pyrene.urdf'
+class MultiSessionCalibration(ComputeCalibration):
+    """
+    Calibration over several sessions
 
+    Each file read by readData is a session, and a directory written by
+    measurements.py may contain several sessions. Joint offsets and camera
+    position are shared by all sessions, the positions of the supports in
+    the wrists are estimated for each session. The variable should be an
+    instance of MultiSessionVariable.
+    """
+    def prepareVariable(self):
+        self.variable.resize(len(self.measurements.sessionNames))
+
+    def stackMeasurements(self):
+        ComputeCalibration.stackMeasurements(self)
+        offsets = self.measurements.sessionOffsets
+        session = np.repeat(np.arange(len(offsets)-1), np.diff(offsets))
+        self.supportIndex = 2*session + self.supportIndex
+
+def initialVariable():
+    """
+    Initial guess of the calibration parameters on Pyrene
+    """
     nj = len(ComputeCalibration.joints)
     q_off = np.array(nj*[0.]).reshape(nj, 1)
     hTc = SE3(Quaternion(x=-0.500, y=0.500, z=-0.500, w=0.500),
@@ -391,9 +1063,113 @@ if __name__ == '__main__':
                 np.array([0.000, 0.000, -0.092]).reshape(3,1))
     rwTrs = SE3(Quaternion(x=0, y=0, z=1, w=0),
                 np.array([0.000, 0.000, -0.092]).reshape(3,1))
-    cc=ComputeCalibration(filename, Variable(q_off,hTc,lwTls,rwTrs))
-    cc.readData('data/measurements-pyrene-20200819-1-filtered.csv')
+    return Variable(q_off,hTc,lwTls,rwTrs)
 
-    for i in range (20):
-        cc.solve()
-        print ("||error|| = {}".format(norm(cc.value)))
+def calibrateFile(urdfFilename, filename, outputDirectory,
+                  solver = 'robust', maxIterations = 100, nThreads = None):
+    """
+    Solve the calibration problem on one measurement file (or directory
+    written by measurements.py) from the initial guess and write in
+    outputDirectory
+      - calibration.xacro: calibration constants (see write_xacro),
+      - outliers.csv: error and weight of each measurement,
+      - telemetry.json: iterations of the solver,
+      - results.json: report of the solver, statistics of the residual
+        and timings.
+    return the content of results.json
+    """
+    t0 = time.time()
+    cc = ComputeCalibration(urdfFilename, initialVariable())
+    cc.verbose = False
+    if nThreads is not None:
+        cc.nThreads = nThreads
+    cc.readData(filename)
+    t1 = time.time()
+    if solver == 'robust':
+        report = cc.solveRobust(maxIterations = maxIterations)
+    else:
+        report = cc.solveLevenbergMarquardt(maxIterations)
+    if not os.path.isdir(outputDirectory):
+        os.makedirs(outputDirectory)
+    with open(os.path.join(outputDirectory, 'calibration.xacro'), 'w') as f:
+        cc.write_xacro(f)
+    cc.writeOutlierReport(os.path.join(outputDirectory, 'outliers.csv'))
+    cc.telemetry.write(os.path.join(outputDirectory, 'telemetry.json'))
+    statistics = errorStatistics(cc.measurementErrors())
+    results = dict(file = filename, measurements = len(cc.measurements),
+                   solver = solver, errorNorm = norm(cc.value),
+                   readTime = t1 - t0, totalTime = time.time() - t0)
+    results.update((k, v) for k, v in report.items())
+    results.update((k, v) for k, v in statistics.items()
+                   if not k.startswith('histogram'))
+    results = dict((k, v.item() if isinstance(v, np.generic) else v)
+                   for k, v in results.items())
+    with open(os.path.join(outputDirectory, 'results.json'), 'w') as f:
+        json.dump(results, f, indent=2)
+    return results
+
+def _calibrateFile(args):
+    try:
+        return calibrateFile(*args)
+    except Exception as exc:
+        return dict(file = args[1], error = str(exc))
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description=
+        'Compute the calibration parameters of Pyrene from measurement files '
+        'or directories written by measurements.py. Files are processed '
+        'independently, in parallel.')
+    p.add_argument('files', type=str, nargs='*',
+                   default=['data/measurements-pyrene-20200819-1.csv'],
+                   help='measurement files, or glob patterns')
+    p.add_argument('--urdf', type=str, default=os.path.join(
+        os.getenv('DEVEL_HPP_DIR', ''),
+        'install/share/talos_data/urdf/pyrene.urdf'), help='robot model')
+    p.add_argument('--output', type=str, default='calibration',
+                   help='directory where a subdirectory is written for each '
+                   'file')
+    p.add_argument('--solver', type=str, choices=['robust', 'lm'],
+                   default='robust',
+                   help='robust loss or Levenberg-Marquardt')
+    p.add_argument('--max-iterations', type=int, default=100,
+                   help='maximal number of iterations')
+    p.add_argument('--processes', type=int, default=cpu_count(),
+                   help='number of worker processes')
+    args = p.parse_args()
+
+    files = list()
+    for pattern in args.files:
+        for f in sorted(glob(pattern)) or [pattern]:
+            if f not in files: files.append(f)
+    nProcesses = max(1, min(args.processes, len(files)))
+    # Processes share the cores: one thread each.
+    tasks = [(args.urdf, f, os.path.join(args.output, os.path.splitext(
+        os.path.basename(os.path.normpath(f)))[0]), args.solver,
+              args.max_iterations, 1 if nProcesses > 1 else None)
+             for f in files]
+    if nProcesses > 1:
+        pool = Pool(nProcesses)
+        try:
+            results = pool.map(_calibrateFile, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_calibrateFile(t) for t in tasks]
+    fields = ['file', 'measurements', 'iterations', 'converged', 'errorNorm',
+              'errorMedian', 'errorMax', 'rejected', 'totalTime', 'error']
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    with open(os.path.join(args.output, 'summary.csv'), 'w') as f:
+        w = writer(f)
+        w.writerow(fields)
+        for r in results:
+            w.writerow([r.get(k, '') for k in fields])
+            if 'error' in r:
+                print('{}: {}'.format(r['file'], r['error']))
+            else:
+                print('{}: {} measurements, ||error|| = {}, {} rejected, '
+                      '{:.3f} s'.format(r['file'], r['measurements'],
+                                        r['errorNorm'],
+                                        len(r.get('rejected', [])),
+                                        r['totalTime']))
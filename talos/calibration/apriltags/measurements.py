@@ -0,0 +1,278 @@
+# Copyright 2020 CNRS - Airbus SAS
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Storage of calibration measurements
+#
+# Measurements are recorded by CalibrationControl.save (play_motion.py) in
+# CSV format. This module reads them into arrays and stores them in a
+# directory of numpy files that can be memory-mapped:
+#
+#   joint_names.npy     names of the joints,
+#   joint_states.npy    (M, n) float64 joint values,
+#   gripper.npy         (M,) int8, 0 for the left gripper, 1 for the right,
+#   poses.npy           (M, 7) float64 pose of the support in the camera
+#                       frame (x, y, z, qx, qy, qz, qw),
+#   lines.npy           (M,) line of each measurement in its CSV file,
+#   session_names.npy   names of the sessions (CSV files),
+#   session_offsets.npy measurements of session i are rows
+#                       session_offsets [i]:session_offsets [i+1].
+#
+# Conversion from CSV files:
+#
+#   python measurements.py output-directory data/*.csv
+
+import argparse, os
+import numpy as np
+from csv import reader
+
+gripperTags = ['left_gripper', 'right_gripper']
+
+def quaternionToRotation(quaternions):
+    """
+    Rotation matrices of a batch of quaternions
+      - quaternions: array of dimension (M,4) in (x, y, z, w) order.
+    return array of dimension (M,3,3)
+    """
+    q = np.asarray(quaternions, dtype=float)
+    q = q / np.linalg.norm(q, axis=-1)[:,None]
+    x, y, z, w = q[:,0], q[:,1], q[:,2], q[:,3]
+    R = np.empty((len(q),3,3))
+    R[:,0,0] = 1 - 2*(y*y + z*z)
+    R[:,0,1] = 2*(x*y - z*w)
+    R[:,0,2] = 2*(x*z + y*w)
+    R[:,1,0] = 2*(x*y + z*w)
+    R[:,1,1] = 1 - 2*(x*x + z*z)
+    R[:,1,2] = 2*(y*z - x*w)
+    R[:,2,0] = 2*(x*z - y*w)
+    R[:,2,1] = 2*(y*z + x*w)
+    R[:,2,2] = 1 - 2*(x*x + y*y)
+    return R
+
+def parseRow(row, i):
+    """
+    Parse a line of measurement file
+      - row: list of strings,
+      - i: index of the line in the file (starting from 0).
+    return joint values, gripper index and pose (x, y, z, qx, qy, qz, qw)
+    """
+    # check that line starts with joint_states
+    if row [0] != 'joint_states':
+        raise SyntaxError('line {} does not start by keyword "joint_states"'
+                          .format(i+1))
+    # make sure that one and only one of 'left_gripper' and 'right_gripper'
+    # is specified in the current line.
+    tags = [(k, row.index(t)) for k, t in enumerate(gripperTags) if t in row]
+    if len(tags) == 0:
+        raise SyntaxError \
+           ('line {} contains neither "left_gripper" nor "right_gripper" tag.'
+             .format(i+1))
+    if len(tags) > 1:
+        raise SyntaxError \
+           ('line {} contains both "left_gripper" and "right_gripper" tags.'
+             .format(i+1))
+    gripper, it = tags [0]
+    try:
+        q = [float(v) for v in row [1:it]]
+    except ValueError as exc:
+        raise SyntaxError\
+           ('line {}, tag "joint_states": could not convert list {} to float'.
+                               format(i+1, row [1:it]))
+    try:
+        pose = [float(v) for v in row [it+1:]]
+    except ValueError as exc:
+        pose = None
+    if pose is None or len(pose) != 7:
+        raise SyntaxError\
+           ('line {}, tag "{}": could not convert list {} to pose'.
+                               format(i+1, gripperTags [gripper], row [it+1:]))
+    return q, gripper, pose
+
+class Measurements(object):
+    """
+    Measurements of one or several calibration sessions, stored by columns
+      - jointNames: list of joint names,
+      - jointStates: (M,n) array of joint values,
+      - gripper: (M,) array, 0 for the left gripper, 1 for the right gripper,
+      - poses: (M,7) array, measured poses of the support in the camera
+        frame (x, y, z, qx, qy, qz, qw),
+      - lines: (M,) array, line of each measurement in its CSV file,
+      - sessionNames: list of session names,
+      - sessionOffsets: (S+1,) array, measurements of session i are rows
+        sessionOffsets [i]:sessionOffsets [i+1].
+    """
+    arrays = ['jointStates', 'gripper', 'poses', 'lines', 'sessionOffsets']
+    files = dict(jointNames = 'joint_names.npy',
+                 jointStates = 'joint_states.npy', gripper = 'gripper.npy',
+                 poses = 'poses.npy', lines = 'lines.npy',
+                 sessionNames = 'session_names.npy',
+                 sessionOffsets = 'session_offsets.npy')
+
+    def __init__(self, jointNames, jointStates, gripper, poses, lines,
+                 sessionNames, sessionOffsets):
+        self.jointNames = list(jointNames)
+        self.jointStates = jointStates
+        self.gripper = gripper
+        self.poses = poses
+        self.lines = lines
+        self.sessionNames = list(sessionNames)
+        self.sessionOffsets = sessionOffsets
+
+    def __len__(self):
+        return len(self.gripper)
+
+    @property
+    def left(self):
+        return self.gripper == 0
+
+    def rotations(self):
+        return quaternionToRotation(self.poses [:,3:7])
+
+    def translations(self):
+        return self.poses [:,0:3]
+
+    def session(self, i):
+        """
+        Measurements of session i, as views on the arrays of self
+        """
+        b, e = self.sessionOffsets [i], self.sessionOffsets [i+1]
+        return Measurements(self.jointNames, self.jointStates [b:e],
+                            self.gripper [b:e], self.poses [b:e],
+                            self.lines [b:e], self.sessionNames [i:i+1],
+                            np.array([0, e - b]))
+
+    @staticmethod
+    def readCsv(filename):
+        """
+        Read a file written by CalibrationControl.save
+        """
+        with open(filename, 'r') as f:
+            rows = list(reader(f))
+        if len(rows) == 0 or rows [0][0] != 'joint_names':
+            raise SyntaxError \
+                ('expecting tag "joint_names" in first line of {}'.format
+                 (filename))
+        jointNames = rows [0][1:]
+        q = list(); gripper = list(); poses = list()
+        for i, row in enumerate(rows [1:]):
+            qi, gi, pi = parseRow(row, i+1)
+            if len(q) > 0 and len(qi) != len(q [0]):
+                raise SyntaxError('line {}: expecting {} joint values, got {}'
+                                  .format(i+2, len(q [0]), len(qi)))
+            q.append(qi); gripper.append(gi); poses.append(pi)
+        M = len(q)
+        return Measurements(jointNames,
+            np.array(q, dtype=np.float64).reshape(M, -1),
+            np.array(gripper, dtype=np.int8),
+            np.array(poses, dtype=np.float64).reshape(M, 7),
+            np.arange(2, M+2, dtype=np.int32),
+            [os.path.basename(filename)], np.array([0, M]))
+
+    @staticmethod
+    def load(directory, mmap = True):
+        """
+        Load measurements saved by method save
+
+        If mmap is True, arrays are memory-mapped and not read.
+        """
+        values = dict()
+        for k, f in Measurements.files.items():
+            mode = 'r' if mmap and k in Measurements.arrays else None
+            values [k] = np.load(os.path.join(directory, f), mmap_mode = mode)
+        values ['jointNames'] = values ['jointNames'].tolist()
+        values ['sessionNames'] = values ['sessionNames'].tolist()
+        return Measurements(**values)
+
+    @staticmethod
+    def read(filename, mmap = True):
+        """
+        Read measurements either in a CSV file or in a directory written by
+        method save
+        """
+        if os.path.isdir(filename):
+            return Measurements.load(filename, mmap)
+        return Measurements.readCsv(filename)
+
+    @staticmethod
+    def concatenate(measurements):
+        """
+        Concatenate several sets of measurements into one
+
+        Joint values are reordered according to the joint names of the first
+        set if needed.
+        """
+        jointNames = measurements [0].jointNames
+        n = measurements [0].jointStates.shape [1]
+        jointStates = list()
+        for m in measurements:
+            if m.jointNames == jointNames and m.jointStates.shape [1] == n:
+                jointStates.append(m.jointStates)
+            elif sorted(m.jointNames) == sorted(jointNames) and \
+                 m.jointStates.shape [1] == len(m.jointNames) == n:
+                jointStates.append(m.jointStates [:,[m.jointNames.index(j)
+                                                     for j in jointNames]])
+            else:
+                raise ValueError('sessions {} and {} have incompatible joints'
+                                 .format(measurements [0].sessionNames,
+                                         m.sessionNames))
+        offsets = [0]
+        for m in measurements:
+            offsets.extend(offsets [-1] + np.asarray(m.sessionOffsets [1:]))
+        return Measurements(jointNames, np.concatenate(jointStates),
+            np.concatenate([m.gripper for m in measurements]),
+            np.concatenate([m.poses for m in measurements]),
+            np.concatenate([m.lines for m in measurements]),
+            sum([m.sessionNames for m in measurements], []),
+            np.array(offsets))
+
+    def save(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for k, f in self.files.items():
+            v = getattr(self, k)
+            if k in ['jointNames', 'sessionNames']:
+                v = np.array(v, dtype=np.str_)
+            np.save(os.path.join(directory, f), np.ascontiguousarray(v))
+
+    def equals(self, other):
+        return self.jointNames == other.jointNames and \
+            self.sessionNames == other.sessionNames and \
+            all(np.array_equal(getattr(self, k), getattr(other, k))
+                for k in self.arrays)
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description=
+        'Convert calibration measurements from CSV format to numpy arrays')
+    p.add_argument('output', type=str, help='output directory')
+    p.add_argument('files', type=str, nargs='+', help='CSV files')
+    args = p.parse_args()
+    m = Measurements.concatenate([Measurements.readCsv(f)
+                                  for f in args.files])
+    m.save(args.output)
+    # check that conversion is lossless
+    if not m.equals(Measurements.load(args.output)):
+        raise RuntimeError('measurements read in {} differ from CSV files'
+                           .format(args.output))
+    print('{} measurements of {} session(s) written in {}'.format
+          (len(m), len(m.sessionNames), args.output))
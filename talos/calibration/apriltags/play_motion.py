@@ -35,8 +35,9 @@ from dynamic_graph_bridge_msgs.msg import Vector
 import geometry_msgs.msg
 from sensor_msgs.msg import JointState
 from smach_msgs.msg import SmachContainerStatus
-from std_msgs.msg import Bool, UInt32
+from std_msgs.msg import Bool, Float64MultiArray, MultiArrayDimension, UInt32
 from hpp.corbaserver import Client as HppClient
+from recursive_calibration import RecursiveCalibration
 
 ## Control calibration motions on Talos robot
 #
@@ -46,6 +47,11 @@ from hpp.corbaserver import Client as HppClient
 #    - wait for end of motion by listening "/agimus/status/running" topic,
 #    - record tf transformation between camera (topic ) and gripper
 #    - record joint values (topic ).
+#
+#  If a calibration problem is provided (see startEstimation), the
+#  calibration parameters are estimated after each measurement and
+#  published with their covariance in topics "/calibration/estimate" and
+#  "/calibration/covariance".
 class CalibrationControl (object):
     cameraFrame = "rgbd_rgb_optical_frame"
     leftGripper  = "gripper_left_base_link_measured"
@@ -74,6 +80,28 @@ class CalibrationControl (object):
         self.hppClient = HppClient ()
         self.count = 0
         self.measurements = list ()
+        self.calibration = None
+        self.estimator = None
+        self.pubEstimate = rospy.Publisher ("/calibration/estimate",
+                                            Float64MultiArray, queue_size=1)
+        self.pubCovariance = rospy.Publisher ("/calibration/covariance",
+                                              Float64MultiArray, queue_size=1)
+
+    ## Estimate calibration parameters while collecting data
+    #
+    #  \param calibration instance of ComputeCalibration, the variable of
+    #         which is the initial guess.
+    def startEstimation (self, calibration):
+        self.calibration = calibration
+        self.estimator = None
+
+    ## Whether the estimated parameters have converged
+    #
+    #  \param targetStd standard deviation below which a parameter is
+    #         considered as estimated.
+    def hasConverged (self, targetStd):
+        return self.estimator is not None and \
+            self.estimator.hasConverged (targetStd)
 
     def playPath (self, pathId):
         nbPaths = self.hppClient.problem.numberPaths ()
@@ -131,6 +159,36 @@ class CalibrationControl (object):
         elif self.sotJointStates:
             measurement ["joint_states"] = self.sotJointStates
         self.measurements.append (measurement)
+        if self.calibration:
+            self.updateEstimate (measurement)
+
+    def updateEstimate (self, measurement):
+        # Joints are identified by names: only ROS joint states can be used.
+        if not self.jointNames or not self.rosJointStates:
+            rospy.loginfo ("No joint names, cannot update estimate")
+            return
+        if self.estimator is None:
+            self.estimator = RecursiveCalibration (self.calibration,
+                                                   self.jointNames)
+        for k in ["left_gripper", "right_gripper"]:
+            if measurement.has_key (k):
+                T = measurement [k].translation
+                R = measurement [k].rotation
+                self.estimator.addMeasurement \
+                    (measurement ["joint_states"], k,
+                     (T.x,T.y,T.z,R.x,R.y,R.z,R.w))
+        estimate = Float64MultiArray ()
+        estimate.data = self.estimator.estimate ().tolist ()
+        self.pubEstimate.publish (estimate)
+        P = self.estimator.covariance ()
+        covariance = Float64MultiArray ()
+        covariance.layout.dim = [
+            MultiArrayDimension (label = "rows", size = P.shape [0],
+                                 stride = P.size),
+            MultiArrayDimension (label = "cols", size = P.shape [1],
+                                 stride = P.shape [1])]
+        covariance.data = P.reshape (-1).tolist ()
+        self.pubCovariance.publish (covariance)
 
     def save (self, filename):
         with open (filename, "w") as f:
@@ -193,9 +251,16 @@ class CalibrationControl (object):
         if not self.jointNames:
             self.jointNames = msg.name
 
-def playAllPaths (startIndex):
+## Play paths from startIndex
+#
+#  If targetStd is provided and calibration parameters are estimated, stop
+#  as soon as the estimate has converged.
+def playAllPaths (startIndex, targetStd = None):
     i = startIndex
     while i < nbPaths - 1:
+        if targetStd is not None and cc.hasConverged (targetStd):
+            rospy.loginfo ("Calibration parameters have converged")
+            break
         cc.playPath (i)
         if not cc.errorOccured:
             print("Ran {}".format(i))
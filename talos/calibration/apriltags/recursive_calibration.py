@@ -0,0 +1,129 @@
+# Copyright 2020 CNRS - Airbus SAS
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Recursive estimation of the calibration parameters
+#
+# The estimate is updated after each measurement by a square root
+# information filter: the information on the parameters is stored as an
+# upper triangular matrix R (R^T R is the information matrix) in the tangent
+# space at the current estimate. A new measurement, linearized at the
+# estimate, is appended below R and the system is triangularized again by a
+# QR decomposition. The linearization is iterated a few times to account for
+# the non-linearity of the measurement.
+
+import numpy as np
+from pinocchio import Quaternion
+from measurements import quaternionToRotation
+
+class RecursiveCalibration(object):
+    """
+    Recursive estimation of the calibration parameters
+      - calibration: instance of ComputeCalibration, the variable of which is
+        the initial guess. It is updated by each measurement.
+      - jointNames: names of the joints, in the order of the joint values
+        provided to addMeasurement.
+    """
+    # Standard deviations of the measurement of a support by the camera
+    translationNoise = 0.005
+    rotationNoise = 0.01
+    # Standard deviation of the initial guess
+    priorStd = 0.1
+    # Number of linearizations of each measurement
+    iterations = 3
+    # A parameter has converged when its standard deviation is below the
+    # target or decreased by less than stallRatio over the last window
+    # measurements.
+    stallRatio = 0.01
+    window = 10
+
+    def __init__(self, calibration, jointNames):
+        self.calibration = calibration
+        self.indices = [list(jointNames).index(j) for j in calibration.joints]
+        self.R = np.eye(calibration.cols)/self.priorStd
+        self.sigma = np.array(3*[self.translationNoise] +
+                              3*[self.rotationNoise])
+        self.history = [self.std()]
+
+    def addMeasurement(self, jointStates, gripper, pose):
+        """
+        Update the estimate with a measurement
+          - jointStates: values of the joints, in the order of jointNames,
+          - gripper: 'left_gripper' or 'right_gripper',
+          - pose: pose of the support in the camera frame
+                  (x, y, z, qx, qy, qz, qw).
+        """
+        cc = self.calibration
+        q = np.asarray(jointStates, dtype=float)[self.indices].reshape(1,-1)
+        left = np.array([gripper == 'left_gripper'])
+        meas_R = quaternionToRotation(np.array(pose[3:7]).reshape(1,4))
+        meas_p = np.array(pose[0:3], dtype=float).reshape(1,3)
+        # offset of the current linearization point from the estimate
+        d = np.zeros(cc.cols)
+        for i in range(self.iterations):
+            value, J = cc.evaluate(q, left, meas_R, meas_p)
+            A = np.vstack((self.R, J[0]/self.sigma[:,None]))
+            b = np.concatenate((-self.R.dot(d), -value[0]/self.sigma))
+            Q, R = np.linalg.qr(A)
+            delta = np.linalg.solve(R, Q.T.dot(b))
+            cc.applyStep(delta.reshape(-1,1))
+            d += delta
+        # The step solves the linearized problem exactly: the information is
+        # R around the new estimate.
+        self.R = R
+        self.history.append(self.std())
+
+    def covariance(self):
+        """
+        Covariance of the parameters, in the order of the columns of the
+        Jacobian of the calibration problem
+        """
+        Rinv = np.linalg.inv(self.R)
+        return Rinv.dot(Rinv.T)
+
+    def std(self):
+        return np.sqrt(np.diag(self.covariance()))
+
+    def hasConverged(self, targetStd):
+        """
+        Whether each parameter has a standard deviation below targetStd
+        or stopped decreasing
+        """
+        if len(self.history) <= self.window:
+            return False
+        std = self.history[-1]
+        previous = self.history[-1-self.window]
+        return bool(np.all((std <= targetStd) |
+                           (std >= (1 - self.stallRatio)*previous)))
+
+    def estimate(self):
+        """
+        Current estimate as a vector: joint offsets followed by hTc and the
+        supports, each as (x, y, z, qx, qy, qz, qw)
+        """
+        v = self.calibration.variable
+        return np.concatenate([v.q_off.reshape(-1)] +
+            [np.concatenate((T.translation, Quaternion(T.rotation).coeffs()))
+             for T in [v.hTc] + v.supports()])
@@ -45,6 +45,10 @@ from hpp.gepetto.manipulation import ViewerFactory
 from hpp.corbaserver.manipulation.constraint_graph_factory import \
     ConstraintGraphFactory
 
+from configuration_distance import ConfigurationDistance, ExecutionTime, \
+    ConfigurationIndex
+from tour_optimization import optimizeTour
+from roadmap_validation import EdgeValidator
 from common_hpp import createGripperLockedJoints, createLeftArmLockedJoints, \
     createRightArmLockedJoints, createQuasiStaticEquilibriumConstraint, \
     createWaistYawConstraint, defaultContext, shrinkJointRange
@@ -62,6 +66,8 @@ p.add_argument ('--arm', type=str, metavar='arm',
                 help="which arm: 'right' or 'left'")
 p.add_argument ('--N', type=int, metavar='N', default=0,
                 help="number of configurations generated")
+p.add_argument ('--contexts', type=int, metavar='contexts', default=1,
+                help="number of contexts validating roadmap edges in parallel")
 args = p.parse_args ()
 
 # Write configurations in a file in CSV format
@@ -131,61 +137,52 @@ def shootRandomConfigs (ps, graph, q0, n):
     return configs
 
 def buildDistanceMatrix (ps, configs):
-    N = len (configs)
-    # Build matrix of distances between box poses
-    dist = np.matrix (np.zeros (N*N).reshape (N,N))
-    for i in range (N):
-        for j in range (i+1,N):
-            dist [i,j] = distance (ps, configs [i], configs [j])
-            dist [j,i] = dist [i,j]
-    return dist
-
-def orderConfigurations (ps, configs):
-    N = len (configs)
-    # Order configurations according to naive solution to traveler
-    # salesman problem
-    notVisited = range (1,N)
-    visited = range (0,1)
-    dist = buildDistanceMatrix (ps, configs)
-    while len (notVisited) > 0:
-        # rank of current configuration in visited
-        i = visited [-1]
-        # find closest not visited configuration
-        m = 1e20
-        closest = None
-        for j in notVisited:
-            if dist [i,j] < m:
-                m = dist [i,j]
-                closest = j
-        notVisited.remove (closest)
-        visited.append (closest)
-    orderedConfigs = list ()
-    for i in visited:
-        orderedConfigs.append (configs [i])
-    return orderedConfigs
-
-# get indices of closest configs to config [i]
-def getClosest (dist,i,n):
-    d = list()
-    for j in range (dist.shape[1]):
-        if j!=i:
-            d.append ((j,dist[i,j]))
-    d.sort (key=lambda x:x[1])
-    return zip (*d)[0][:n]
-
-def buildRoadmap (configs):
+    # Build matrix of distances between configurations
+    return ConfigurationDistance (ps).matrix (configs)
+
+# Build matrix of estimated durations of the direct paths between
+# configurations, after time parameterization with the parameters of ps
+def buildExecutionTimeMatrix (ps, configs):
+    return ExecutionTime (ps).matrix (configs)
+
+def orderConfigurations (ps, configs, start = 0, end = None, timeBudget = 1.):
+    # Order configurations according to a short solution to traveler
+    # salesman problem starting at configs [start] and ending at
+    # configs [end] (free end if None, back to start if end == start).
+    # The cost between configurations is the execution time of the path.
+    # Return the list of indices of configs in the order of visit.
+    cost = buildExecutionTimeMatrix (ps, configs)
+    return optimizeTour (cost, start, end, timeBudget)
+
+# get indices and distances of the n closest configs to each config
+def getClosest (ps, configs, n):
+    index = ConfigurationIndex (ConfigurationDistance (ps), configs)
+    return index.kNearest (n)
+
+# If validator is an instance of EdgeValidator, the direct paths of the
+# edges are validated in parallel in the contexts of the validator.
+def buildRoadmap (configs, validator = None):
     if len(configs)==0: return
-    dist = buildDistanceMatrix (ps, configs)
+    closest, dist = getClosest (ps, configs, 20)
     for q in configs:
         ps.addConfigToRoadmap(q)
-    for i, q in enumerate (configs):
-        ps.addConfigToRoadmap (q)
-        closest = getClosest (dist,i,20)
-        for j in closest:
-            if dist[i,j] != 0 and j>i:
+    edges = [(i, int (j)) for i in range (len (configs))
+             for j, d in zip (closest [i], dist [i]) if d != 0 and j>i]
+    if validator is None:
+        for i, j in edges:
+            qi=configs[i]
+            qj=configs[j]
+            res, pid, msg = ps.directPath(qi,qj,True)
+            if res:
+                ps.addEdgeToRoadmap (qi,qj,pid,True)
+    else:
+        valid = validator.validate (configs, edges)
+        for (i, j), res in zip (edges, valid):
+            if res:
+                # the path has been validated in another context
                 qi=configs[i]
                 qj=configs[j]
-                res, pid, msg = ps.directPath(qi,qj,True)
+                res, pid, msg = ps.directPath(qi,qj,False)
                 if res:
                     ps.addEdgeToRoadmap (qi,qj,pid,True)
     # clear paths
@@ -214,55 +211,65 @@ HumanoidRobot.rightAnkle = "talos/leg_right_6_joint"
 
 initConf = [0, 0, 1.095, 0, 0, 0, 1, 0.0, 0.0, -0.411354, 0.859395, -0.448041, -0.001708, 0.0, 0.0, -0.411354, 0.859395, -0.448041, -0.001708, 0, 0.006761, 0.25847, 0.173046, -0.0002, -0.525366, 0, 0, 0.1, 0, 0, 0, 0, 0, 0, 0, -0.25847, -0.173046, 0.0002, -0.525366, 0, 0, 0.1, 0, 0, 0, 0, 0, 0, 0, 0, 0]
 
-robot = HumanoidRobot("talos", "talos", rootJointType="freeflyer")
-shrinkJointRange (robot, 0.95)
-# set freeflyerjoint bounds
-robot.setJointBounds ("talos/root_joint",
-                      [-0.5, 0.5,-0.5, 0.5,0.5, 1.5,
-                       -1.01, 1.01, -1.01, 1.01, -1.01, 1.01, -1.01, 1.01])
-
-ps = ProblemSolver (robot)
-ps.setErrorThreshold (1e-4)
-ps.setMaxIterProjection (40)
-
+# Build the robot, the constraints and the constraint graph of the problem
+# with a client connected to a context of the server
+def makeProblem (client):
+    robot = HumanoidRobot("talos", "talos", rootJointType="freeflyer",
+                          client=client)
+    shrinkJointRange (robot, 0.95)
+    # set freeflyerjoint bounds
+    robot.setJointBounds ("talos/root_joint",
+                          [-0.5, 0.5,-0.5, 0.5,0.5, 1.5,
+                           -1.01, 1.01, -1.01, 1.01, -1.01, 1.01, -1.01, 1.01])
+
+    ps = ProblemSolver (robot)
+    ps.setErrorThreshold (1e-4)
+    ps.setMaxIterProjection (40)
+
+    left_arm_lock  = createLeftArmLockedJoints (ps)
+    right_arm_lock = createRightArmLockedJoints (ps)
+    if args.arm == 'left':
+        arm_locked = right_arm_lock
+    elif args.arm == 'right':
+        arm_locked = left_arm_lock
+    else:
+        arm_locked = list()
+
+    left_gripper_lock, right_gripper_lock = createGripperLockedJoints (ps, initConf)
+    com_constraint, foot_placement, foot_placement_complement = \
+        createQuasiStaticEquilibriumConstraint (ps, initConf)
+    gaze_constraint = createGazeConstraint (ps,args.arm)
+    waist_constraint = createWaistYawConstraint (ps)
+
+    graph = ConstraintGraph(robot, "graph")
+
+    graph.createNode(["free", "starting_state"])
+    graph.createEdge("starting_state", "free", "starting_motion", isInNode="starting_state")
+    graph.createEdge("free", "starting_state", "go_to_starting_state", isInNode="starting_state")
+    graph.createEdge("free", "free", "Loop | f", isInNode="starting_state")
+
+    # Set constraints
+    graph.addConstraints (node = "starting_state", constraints = Constraints (
+        numConstraints = com_constraint + foot_placement + left_gripper_lock +
+        right_gripper_lock
+    ))
+    graph.addConstraints (node = "free", constraints = Constraints (
+        numConstraints = com_constraint + foot_placement + left_gripper_lock +
+        right_gripper_lock + gaze_constraint + waist_constraint
+    ))
+    graph.addConstraints (edge = "Loop | f", constraints = Constraints (
+        numConstraints = com_constraint + foot_placement + arm_locked
+    ))
+
+    graph.initialize ()
+    return robot, ps, graph
+
+robot, ps, graph = makeProblem (client)
 vf = ViewerFactory (ps)
-
-left_arm_lock  = createLeftArmLockedJoints (ps)
-right_arm_lock = createRightArmLockedJoints (ps)
-if args.arm == 'left':
-    arm_locked = right_arm_lock
-elif args.arm == 'right':
-    arm_locked = left_arm_lock
+if args.contexts > 1:
+    validator = EdgeValidator (lambda c: makeProblem (c) [1], args.contexts)
 else:
-    arm_locked = list()
-
-left_gripper_lock, right_gripper_lock = createGripperLockedJoints (ps, initConf)
-com_constraint, foot_placement, foot_placement_complement = \
-    createQuasiStaticEquilibriumConstraint (ps, initConf)
-gaze_constraint = createGazeConstraint (ps,args.arm)
-waist_constraint = createWaistYawConstraint (ps)
-
-graph = ConstraintGraph(robot, "graph")
-
-graph.createNode(["free", "starting_state"])
-graph.createEdge("starting_state", "free", "starting_motion", isInNode="starting_state")
-graph.createEdge("free", "starting_state", "go_to_starting_state", isInNode="starting_state")
-graph.createEdge("free", "free", "Loop | f", isInNode="starting_state")
-
-# Set constraints
-graph.addConstraints (node = "starting_state", constraints = Constraints (
-    numConstraints = com_constraint + foot_placement + left_gripper_lock +
-    right_gripper_lock
-))
-graph.addConstraints (node = "free", constraints = Constraints (
-    numConstraints = com_constraint + foot_placement + left_gripper_lock +
-    right_gripper_lock + gaze_constraint + waist_constraint
-))
-graph.addConstraints (edge = "Loop | f", constraints = Constraints (
-    numConstraints = com_constraint + foot_placement + arm_locked
-))
-
-graph.initialize ()
+    validator = None
 
 ps.setParameter("SimpleTimeParameterization/safety", 0.5)
 ps.setParameter("SimpleTimeParameterization/order", 2)
@@ -288,11 +295,18 @@ N = args.N
 if N != 0:
     configs = [q [::]]
     configs += shootRandomConfigs (ps, graph,configs [0], N)
-    configs = orderConfigurations (ps, configs)
     configs.append (initConf)
+    # visit configurations from q to initConf
+    order = orderConfigurations (ps, configs, 0, len (configs) - 1)
+    configs = [configs [i] for i in order]
 else:
     #read configurations in a file
     configs = readConfigsInFile('./data/all-configurations.csv')
     
-buildRoadmap(configs)
+try:
+    buildRoadmap(configs, validator)
+finally:
+    # delete the contexts of the validator from the server
+    if validator is not None:
+        validator.close ()
 visitConfigurations (ps, configs)
@@ -0,0 +1,211 @@
+# Copyright 2020 CNRS - Airbus SAS
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Selection of the configurations played during a calibration session
+#
+# Each configuration where a wrist is visible from the camera provides a
+# measurement whose Jacobian J_i (6 x cols) is computed by ComputeCalibration.
+# Configurations are picked greedily so as to maximize the determinant of
+# the information matrix
+#
+#   F = F_0 + sum_i J_i^T Sigma^{-1} J_i
+#
+# where Sigma is the covariance of a measurement and F_0 a weak prior, until
+# the standard deviations predicted by F^{-1} reach a target.
+#
+# Usage:
+#
+#   python select_configurations.py --urdf pyrene.urdf \
+#       --input data/all-configurations.csv --output data/selected.csv \
+#       --std 1e-3
+
+import argparse, os
+import numpy as np
+from csv import reader, writer
+from compute_calibration import ComputeCalibration, initialVariable
+from pinocchio import buildModelFromUrdf, exp6
+
+def readConfigurations(filename):
+    with open(filename, 'r') as f:
+        return np.array([list(map(float, line)) for line in reader(f)])
+
+def writeConfigurations(filename, configurations):
+    with open(filename, 'w') as f:
+        w = writer(f)
+        for q in configurations:
+            w.writerow(list(q))
+
+class ConfigurationSelection(object):
+    """
+    Greedy D-optimal selection of calibration configurations
+      - calibration: instance of ComputeCalibration, the variable of which is
+        the current estimate of the parameters,
+      - configurations: (N, nq) array of configurations of the robot with a
+        root joint of size rootSize, as stored in all-configurations.csv.
+    """
+    # Standard deviations of the measurement of a support by the camera
+    translationNoise = 0.005
+    rotationNoise = 0.01
+    # Standard deviation of the prior on the parameters
+    priorStd = 1.
+    # Size of the root joint in the configurations
+    rootSize = 7
+    # Standard deviation required for the parameters that cannot reach the
+    # target, relative to the standard deviation with all configurations
+    relativeTolerance = 1.5
+
+    def __init__(self, calibration, configurations):
+        self.calibration = calibration
+        self.configurations = np.asarray(configurations)
+        # indices of the calibrated joints in the configurations
+        model = buildModelFromUrdf(calibration.urdfFilename)
+        indices = [self.rootSize + model.joints[model.getJointId(j)].idx_q
+                   for j in calibration.joints]
+        self.jointValues = self.configurations[:,indices]
+        self.left = self.visibleSide()
+        self.jacobians = self.computeJacobians(self.left)
+
+    def _evaluate(self, left, meas_R = None, meas_p = None):
+        # Evaluate the calibration problem on the candidate configurations
+        N = len(self.jointValues)
+        return self.calibration.evaluate(self.jointValues, np.full(N, left)
+            if np.isscalar(left) else left,
+            np.tile(np.eye(3), (N,1,1)) if meas_R is None else meas_R,
+            np.zeros((N,3)) if meas_p is None else meas_p)
+
+    def predictedPoses(self, left):
+        """
+        Poses of the supports in the camera frame predicted by the current
+        estimate
+        """
+        value, _ = self._evaluate(left)
+        poses = [exp6(v) for v in value]
+        return np.array([T.rotation for T in poses]), \
+            np.array([np.array(T.translation).reshape(3) for T in poses])
+
+    def visibleSide(self):
+        """
+        For each configuration, whether the left support is the one seen by
+        the camera: the support in front of the camera that is the closest
+        to the optical axis.
+        """
+        angles = list()
+        for left in [True, False]:
+            R, p = self.predictedPoses(left)
+            a = np.arctan2(np.hypot(p[:,0], p[:,1]), p[:,2])
+            angles.append(np.where(p[:,2] > 0, a, np.inf))
+        return angles[0] <= angles[1]
+
+    def computeJacobians(self, left):
+        """
+        Jacobians of the measurements, computed at the measurement predicted
+        by the current estimate
+        """
+        R, p = self.predictedPoses(left)
+        _, J = self._evaluate(left, R, p)
+        return J
+
+    def informationMatrix(self, indices):
+        cc = self.calibration
+        sigma = np.array(3*[self.translationNoise] + 3*[self.rotationNoise])
+        F = np.eye(cc.cols)/self.priorStd**2
+        J = self.jacobians[indices]/sigma[None,:,None]
+        return F + np.einsum('nij,nik->jk', J, J)
+
+    def select(self, targetStd, maxSize = None):
+        """
+        Select configurations greedily until the predicted standard deviation
+        of each parameter gets below targetStd (a scalar or an array of
+        dimension cols).
+
+        Parameters that do not reach the target with all configurations
+        (for instance because they cannot be separated from other ones) are
+        only required to reach relativeTolerance times the standard deviation
+        obtained with all configurations.
+
+        return the list of selected indices, in the order of selection.
+        """
+        N = len(self.jacobians)
+        maxSize = maxSize or N
+        sigma = np.array(3*[self.translationNoise] + 3*[self.rotationNoise])
+        # whitened Jacobians
+        J = self.jacobians/sigma[None,:,None]
+        target = np.broadcast_to(np.asarray(targetStd, dtype=float)**2,
+                                 (self.calibration.cols,))
+        bestVariance = np.diag(np.linalg.inv(self.informationMatrix
+                                             (np.arange(N))))
+        target = np.maximum(target,
+                            self.relativeTolerance**2*bestVariance)
+        self.unreachable = np.flatnonzero(target > np.asarray(targetStd)**2)
+        F = self.informationMatrix([])
+        selected = list()
+        available = np.ones(N, dtype=bool)
+        I6 = np.eye(6)
+        while len(selected) < maxSize:
+            P = np.linalg.inv(F)
+            if np.all(np.diag(P) <= target):
+                break
+            # log det (F + J_i^T J_i) - log det F = log det (I + J_i P J_i^T)
+            S = I6 + np.matmul(np.matmul(J, P), np.swapaxes(J, 1, 2))
+            gain = np.linalg.slogdet(S)[1]
+            gain[~available] = -np.inf
+            i = int(np.argmax(gain))
+            selected.append(i)
+            available[i] = False
+            F += J[i].T.dot(J[i])
+        self.selected = selected
+        self.predictedStd = np.sqrt(np.diag(np.linalg.inv(F)))
+        return selected
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description=
+        'Select a small subset of calibration configurations that maximizes '
+        'the information on the calibration parameters')
+    p.add_argument('--urdf', type=str, default=os.path.join(
+        os.getenv('DEVEL_HPP_DIR', ''),
+        'install/share/talos_data/urdf/pyrene.urdf'), help='robot model')
+    p.add_argument('--input', type=str,
+                   default='data/all-configurations.csv',
+                   help='candidate configurations')
+    p.add_argument('--output', type=str, required=True,
+                   help='file where selected configurations are written')
+    p.add_argument('--std', type=float, default=1e-3,
+                   help='target standard deviation of the parameters')
+    p.add_argument('--max', type=int, default=None,
+                   help='maximal number of configurations')
+    args = p.parse_args()
+
+    cc = ComputeCalibration(args.urdf, initialVariable())
+    configurations = readConfigurations(args.input)
+    s = ConfigurationSelection(cc, configurations)
+    selected = s.select(args.std, args.max)
+    # keep the order of the input file, that is optimized for motion
+    writeConfigurations(args.output, configurations[sorted(selected)])
+    print('{} configurations selected out of {}'.format(len(selected),
+                                                        len(configurations)))
+    for i in s.unreachable:
+        print('{}: target not reachable, standard deviation {}'.format
+              (cc.parameterNames()[i], s.predictedStd[i]))
@@ -0,0 +1,125 @@
+# Copyright 2020 CNRS - Airbus SAS
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Instrumentation of the calibration solvers
+#
+# ComputeCalibration stores in its attribute telemetry, for each iteration
+# of the solvers, the time spent in each stage of the computation, the norms
+# of the error and of the step and the distribution of the measurement
+# errors. The records can be written in JSON or CSV format:
+#
+#   cc.solveLevenbergMarquardt()
+#   cc.telemetry.write('telemetry.json')
+
+import json, threading, time
+import numpy as np
+from contextlib import contextmanager
+from csv import DictWriter
+
+def errorStatistics(errors, bins = 20):
+    """
+    Distribution of the norms of the measurement errors
+    return a dictionary with the quantiles of the errors, the counts and
+    the edges of the bins of the histogram.
+    """
+    counts, edges = np.histogram(errors, bins = bins)
+    q = np.percentile(errors, [0, 50, 90, 100])
+    return dict(errorMin = q[0], errorMedian = q[1], error90 = q[2],
+                errorMax = q[3], histogram = counts.tolist(),
+                histogramEdges = edges.tolist())
+
+class Telemetry(object):
+    """
+    Records of the iterations of the calibration solvers
+
+    The time spent in each stage is accumulated in the current record until
+    method record is called at the end of the iteration. Stages may be
+    timed concurrently by several threads, in which case the time of a
+    stage is the sum of the times of the threads.
+      - records: list of dictionaries, one per iteration.
+    """
+    stages = ['kinematics', 'jacobian', 'solve', 'integration']
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.records = list()
+        # values added to each record, like the index of the reweighting
+        self.tags = dict()
+        self.newRecord()
+
+    def newRecord(self):
+        self.current = dict((s + 'Time', 0.) for s in self.stages)
+        self.start = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Accumulate the time spent in a block of code in stage name
+        """
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - t0)
+
+    def add(self, name, dt):
+        """
+        Add dt seconds to stage name
+        """
+        with self.lock:
+            self.current[name + 'Time'] += dt
+
+    def record(self, **values):
+        """
+        Close the current record with additional values
+        """
+        self.current['totalTime'] = time.time() - self.start
+        self.current.update(self.tags)
+        self.current.update(values)
+        self.records.append(self.current)
+        self.newRecord()
+
+    def write(self, filename):
+        """
+        Write the records in JSON format if filename ends with .json, in CSV
+        format otherwise. Lists (histogram) are only written in JSON format.
+        """
+        records = [dict((k, v.item() if isinstance(v, np.generic) else v)
+                        for k, v in r.items()) for r in self.records]
+        with open(filename, 'w') as f:
+            if filename.endswith('.json'):
+                json.dump(records, f, indent=2)
+                return
+            fields = list()
+            for r in records:
+                fields += [k for k in r if k not in fields and
+                           not isinstance(r[k], list)]
+            w = DictWriter(f, fields, extrasaction = 'ignore')
+            w.writeheader()
+            w.writerows(records)
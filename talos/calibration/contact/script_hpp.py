@@ -51,6 +51,9 @@ from hpp_idl.hpp import Error as HppError
 from agimus_demos.talos.tools_hpp import createGazeConstraints, \
     createGripperLockedJoints, createLeftArmLockedJoints, \
     createRightArmLockedJoints, defaultContext, setGaussianShooter
+from configuration_distance import ConfigurationDistance, \
+    ConfigurationIndex, ExecutionTime
+from tour_optimization import optimizeTour
 from common_hpp import createQuasiStaticEquilibriumConstraint, makeGraph, \
     makeRobotProblemAndViewerFactory
 
@@ -122,61 +125,53 @@ def shootRandomConfigs (ps, graph, q0, n):
     return configs
 
 def buildDistanceMatrix (ps, configs):
-    N = len (configs)
-    # Build matrix of distances between box poses
-    dist = np.matrix (np.zeros (N*N).reshape (N,N))
-    for i in range (N):
-        for j in range (i+1,N):
-            dist [i,j] = distance (ps, configs [i], configs [j])
-            dist [j,i] = dist [i,j]
-    return dist
-
-def orderConfigurations (ps, configs):
-    N = len (configs)
-    # Order configurations according to naive solution to traveler
-    # salesman problem
-    notVisited = range (1,N)
-    visited = range (0,1)
-    dist = buildDistanceMatrix (ps, configs)
-    while len (notVisited) > 0:
-        # rank of current configuration in visited
-        i = visited [-1]
-        # find closest not visited configuration
-        m = 1e20
-        closest = None
-        for j in notVisited:
-            if dist [i,j] < m:
-                m = dist [i,j]
-                closest = j
-        notVisited.remove (closest)
-        visited.append (closest)
-    orderedConfigs = list ()
-    for i in visited:
-        orderedConfigs.append (configs [i])
-    return orderedConfigs
-
-# get indices of closest configs to config [i]
-def getClosest (dist,i,n):
-    d = list()
-    for j in range (dist.shape[1]):
-        if j!=i:
-            d.append ((j,dist[i,j]))
-    d.sort (key=lambda x:x[1])
-    return zip (*d)[0][:n]
-
-def buildRoadmap (configs):
+    # Build matrix of distances between configurations
+    return ConfigurationDistance (ps).matrix (configs)
+
+# Build matrix of estimated durations of the direct paths between
+# configurations, with the parameters of SimpleTimeParameterization of the
+# problem
+def buildExecutionTimeMatrix (ps, configs):
+    return ExecutionTime (ps).matrix (configs)
+
+def orderConfigurations (ps, configs, start = 0, end = None, timeBudget = 1.):
+    # Order configurations according to a short solution to traveler
+    # salesman problem starting at configs [start] and ending at
+    # configs [end] (free end if None, back to start if end == start).
+    # The cost between configurations is the execution time of the path.
+    # Return the list of indices of configs in the order of visit.
+    cost = buildExecutionTimeMatrix (ps, configs)
+    return optimizeTour (cost, start, end, timeBudget)
+
+# get indices and distances of the n closest configs to each config
+def getClosest (ps, configs, n):
+    index = ConfigurationIndex (ConfigurationDistance (ps), configs)
+    return index.kNearest (n)
+
+# If validator is an instance of EdgeValidator, the direct paths of the
+# edges are validated in parallel in the contexts of the validator.
+def buildRoadmap (configs, validator = None):
     if len(configs)==0: return
-    dist = buildDistanceMatrix (ps, configs)
+    closest, dist = getClosest (ps, configs, 20)
     for q in configs:
         ps.addConfigToRoadmap(q)
-    for i, q in enumerate (configs):
-        ps.addConfigToRoadmap (q)
-        closest = getClosest (dist,i,20)
-        for j in closest:
-            if dist[i,j] != 0 and j>i:
+    edges = [(i, int (j)) for i in range (len (configs))
+             for j, d in zip (closest [i], dist [i]) if d != 0 and j>i]
+    if validator is None:
+        for i, j in edges:
+            qi=configs[i]
+            qj=configs[j]
+            res, pid, msg = ps.directPath(qi,qj,True)
+            if res:
+                ps.addEdgeToRoadmap (qi,qj,pid,True)
+    else:
+        valid = validator.validate (configs, edges)
+        for (i, j), res in zip (edges, valid):
+            if res:
+                # the path has been validated in another context
                 qi=configs[i]
                 qj=configs[j]
-                res, pid, msg = ps.directPath(qi,qj,True)
+                res, pid, msg = ps.directPath(qi,qj,False)
                 if res:
                     ps.addEdgeToRoadmap (qi,qj,pid,True)
     # clear paths
@@ -0,0 +1,244 @@
+# Copyright 2020 CNRS - Airbus SAS
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Ordering of configurations to visit
+#
+# The configurations are visited in the order of a short path in the matrix
+# of costs between configurations (travelling salesman problem with fixed
+# start and end). Tours are built by randomized nearest neighbour and improved
+# by local search:
+#   - 2-opt reverses a sub-sequence of the tour,
+#   - Or-opt moves a sub-sequence of 1 to 3 configurations elsewhere in the
+#     tour, possibly reversed.
+# Several starts are run in a pool of processes until a time budget is
+# exhausted or until the best tour has not been improved by several
+# successive starts, and the shortest tour is kept. Small problems are
+# solved exactly by enumeration, and problems of moderate size are solved in
+# the current process to save the creation of the pool.
+#
+# The cost matrix is assumed to be symmetric.
+#
+# This module is copied, identical, in the directories of the demos that use
+# it (., talos/calibration/apriltags and talos/calibration/contact), like
+# common_hpp.py, so that the scripts run from their own directory without
+# installing it. Apply any change to all copies.
+
+from multiprocessing import Pool, cpu_count
+from itertools import permutations
+import time
+import numpy as np
+
+# maximal number of free nodes of problems solved by enumeration
+maxExactSize = 6
+# minimal number of nodes of problems solved in a pool of processes
+minParallelSize = 64
+
+def tourLength(cost, tour):
+    tour = np.asarray(tour)
+    return float(cost [tour [:-1], tour [1:]].sum())
+
+def nearestNeighbourTour(cost, rng = None, candidates = 3):
+    """
+    Tour starting at node 0 and ending at the last node of the matrix
+      - cost: matrix of costs,
+      - rng: if not None, the next node is chosen randomly among the
+        candidates closest nodes, otherwise the closest node is chosen.
+    """
+    n = len(cost)
+    visited = np.zeros(n, dtype=bool)
+    visited [0] = visited [n-1] = True
+    tour = [0]
+    for k in range(n-2):
+        c = np.where(visited, np.inf, cost [tour [-1]])
+        if rng is None:
+            j = int(np.argmin(c))
+        else:
+            m = min(candidates, n-2-k)
+            j = int(rng.choice(np.argsort(c) [:m]))
+        visited [j] = True
+        tour.append(j)
+    tour.append(n-1)
+    return tour
+
+def exactTour(cost):
+    """
+    Shortest tour starting at node 0 and ending at the last node of the
+    matrix, by enumeration of the orders of the other nodes
+    """
+    n = len(cost)
+    best, bestLength = None, np.inf
+    for p in permutations(range(1, n-1)):
+        tour = [0] + list(p) + [n-1]
+        length = tourLength(cost, tour)
+        if length < bestLength:
+            best, bestLength = tour, length
+    return best
+
+def twoOpt(cost, tour):
+    """
+    Apply improving 2-opt moves to the tour, keeping both ends
+    return whether the tour has been improved
+    """
+    t = tour
+    n = len(t)
+    improved = False
+    for i in range(1, n-2):
+        a, b = t [i-1], t [i]
+        j = np.arange(i+1, n-1)
+        tj = np.array(t) [j]; tj1 = np.array(t) [j+1]
+        delta = cost [a, tj] + cost [b, tj1] - cost [a, b] - cost [tj, tj1]
+        k = int(np.argmin(delta))
+        if delta [k] < -1e-12:
+            t [i:j [k]+1] = t [i:j [k]+1][::-1]
+            improved = True
+    return improved
+
+def orOpt(cost, tour, maxLength = 3):
+    """
+    Apply improving Or-opt moves to the tour, keeping both ends
+    return whether the tour has been improved
+    """
+    t = tour
+    improved = False
+    for L in range(1, maxLength+1):
+        i = 1
+        while i + L < len(t):
+            seg = t [i:i+L]
+            p, nx = t [i-1], t [i+L]
+            gain = cost [p, seg [0]] + cost [seg [-1], nx] - cost [p, nx]
+            rest = t [:i] + t [i+L:]
+            r = np.array(rest)
+            # insert between rest [k] and rest [k+1]
+            u, v = r [:-1], r [1:]
+            forward = cost [u, seg [0]] + cost [seg [-1], v] - cost [u, v]
+            backward = cost [u, seg [-1]] + cost [seg [0], v] - cost [u, v]
+            forward [i-1] = backward [i-1] = np.inf
+            k = int(np.argmin(np.minimum(forward, backward)))
+            if min(forward [k], backward [k]) < gain - 1e-12:
+                if backward [k] < forward [k]:
+                    seg = seg [::-1]
+                t [:] = rest [:k+1] + seg + rest [k+1:]
+                improved = True
+            i += 1
+    return improved
+
+def localSearch(cost, tour, deadline = None):
+    while twoOpt(cost, tour) | orOpt(cost, tour):
+        if deadline is not None and time.time() > deadline:
+            break
+    return tour
+
+# cost matrix in the current worker process
+_cost = None
+
+def _initWorker(cost):
+    global _cost
+    _cost = cost
+
+def _searchTours(args):
+    """
+    Run randomized starts until the deadline or until patience successive
+    starts do not improve the best tour, return the best tour
+    """
+    seed, deadline, greedy, patience = args
+    rng = np.random.RandomState(seed)
+    best, bestLength = None, np.inf
+    failures = 0
+    while best is None or (time.time() < deadline and failures < patience):
+        tour = nearestNeighbourTour(_cost, None if greedy else rng)
+        greedy = False
+        localSearch(_cost, tour, deadline)
+        length = tourLength(_cost, tour)
+        if length < bestLength - 1e-12:
+            best, bestLength = tour, length
+            failures = 0
+        else:
+            failures += 1
+    return bestLength, best
+
+def optimizeTour(cost, start = 0, end = None, timeBudget = 1.,
+                 nProcesses = None, seed = 0, patience = 20):
+    """
+    Order of visit of nodes minimizing the sum of the costs between
+    successive nodes
+      - cost: (N,N) symmetric matrix of costs,
+      - start: index of the first node, or None if the first node is free,
+      - end: index of the last node, or None if the last node is free. If end
+        is equal to start, the tour comes back to start,
+      - timeBudget: time in seconds after which no new start is run,
+      - nProcesses: number of worker processes, 1 to run in the current
+        process,
+      - seed: seed of the random number generator,
+      - patience: number of successive starts without improvement after
+        which a worker stops before the time budget.
+    return the list of indices of the nodes in the order of visit (the last
+    node is not repeated when end is equal to start)
+    """
+    cost = np.asarray(cost, dtype=float)
+    N = len(cost)
+    if N < 2:
+        return list(range(N))
+    # Build a matrix where the tour starts at node 0 and ends at the last
+    # node. Free ends are dummy nodes at cost 0 from all nodes.
+    nodes = list()
+    if start is None: nodes.append(-1)
+    else: nodes.append(start)
+    nodes += [i for i in range(N) if i != start and (i != end or end == start)]
+    if end is None: nodes.append(-1)
+    else: nodes.append(end)
+    idx = np.array(nodes)
+    C = cost [np.ix_(np.maximum(idx, 0), np.maximum(idx, 0))]
+    C [idx < 0, :] = 0; C [:, idx < 0] = 0
+    if len(C) - 2 <= maxExactSize:
+        tour = exactTour(C)
+    else:
+        length, tour = min(searchTours(C, timeBudget, nProcesses, seed,
+                                       patience), key = lambda r: r [0])
+    order = [nodes [i] for i in tour if nodes [i] >= 0]
+    if end is not None and end == start:
+        order = order [:-1]
+    return order
+
+def searchTours(C, timeBudget, nProcesses, seed, patience):
+    """
+    Run randomized starts in a pool of processes
+    return the list of best length and best tour of each process
+    """
+    if len(C) < minParallelSize:
+        nProcesses = 1
+    nProcesses = nProcesses or cpu_count()
+    deadline = time.time() + timeBudget
+    args = [(seed + k, deadline, k == 0, patience) for k in range(nProcesses)]
+    if nProcesses > 1:
+        pool = Pool(nProcesses, _initWorker, (C,))
+        try:
+            results = pool.map(_searchTours, args)
+        finally:
+            pool.close(); pool.join()
+    else:
+        _initWorker(C)
+        results = [_searchTours(args [0])]
+    return results
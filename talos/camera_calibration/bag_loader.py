@@ -0,0 +1,263 @@
+# /usr/bin/env python
+
+# Loading of calibration bags
+#
+# A calibration bag contains joint states (sensor_msgs/JointState) and
+# detections of the chessboard in the camera (geometry_msgs/PoseStamped). The
+# bag is read in one pass and the samples are stored in numpy arrays, that are
+# cached in file <bag>.npz next to the bag. The cache is used by later calls
+# as long as the key of the bag (size, modification time and hash of the
+# beginning and of the end of the file) has not changed.
+#
+# Usage:
+#   samples = loadBag("pyrene-calib.bag").synchronize()
+#   for i in range(len(samples)):
+#       samples.jointNames, samples.jointPositions[i], samples.poses[i]
+#
+# Method synchronize pairs each detection with the joint states of the same
+# time, so that a dropped detection does not shift the following samples.
+
+import hashlib
+import os
+
+import numpy as np
+
+# Number of bytes hashed at the beginning and at the end of the bag
+hashedBytes = 1 << 20
+
+
+def bagKey(path):
+    """
+    Key identifying the content of a bag, without reading the whole file
+    """
+    h = hashlib.sha1()
+    size = os.path.getsize(path)
+    h.update(str(size).encode())
+    h.update(str(os.path.getmtime(path)).encode())
+    with open(path, "rb") as f:
+        h.update(f.read(hashedBytes))
+        if size > hashedBytes:
+            f.seek(max(hashedBytes, size - hashedBytes))
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def stampToSec(stamp):
+    return stamp.secs + 1e-9 * stamp.nsecs
+
+
+class BagSamples(object):
+    """
+    Joint states and chessboard detections read in a bag
+    - jointNames: list of joint names,
+    - jointStamps: (N,) header stamps of the joint states (seconds),
+    - jointPositions: (N,n) joint values,
+    - poseStamps: (P,) header stamps of the detections (seconds),
+    - poses: (P,7) poses of the chessboard in the camera
+      (x, y, z, qx, qy, qz, qw).
+
+    The i-th sample is made of the i-th joint state and of the i-th
+    detection: use method synchronize to pair them by time.
+    """
+
+    arrays = ["jointStamps", "jointPositions", "poseStamps", "poses"]
+
+    def __init__(self, jointNames, jointStamps, jointPositions, poseStamps, poses):
+        self.jointNames = list(jointNames)
+        self.jointStamps = jointStamps
+        self.jointPositions = jointPositions
+        self.poseStamps = poseStamps
+        self.poses = poses
+
+    def __len__(self):
+        return min(len(self.jointPositions), len(self.poses))
+
+    @staticmethod
+    def read(path, jointTopic, poseTopic):
+        """
+        Read a bag in one pass
+        """
+        import rosbag
+
+        jointNames = None
+        jointStamps = list()
+        jointPositions = list()
+        poseStamps = list()
+        poses = list()
+        bag = rosbag.Bag(path)
+        try:
+            for topic, msg, t in bag.read_messages(topics=[jointTopic, poseTopic]):
+                if topic == jointTopic:
+                    if jointNames is None:
+                        jointNames = list(msg.name)
+                    elif list(msg.name) != jointNames:
+                        raise RuntimeError(
+                            "{}: joint names of topic {} change.".format(
+                                path, jointTopic
+                            )
+                        )
+                    jointStamps.append(stampToSec(msg.header.stamp))
+                    jointPositions.append(msg.position)
+                else:
+                    p = msg.pose
+                    poseStamps.append(stampToSec(msg.header.stamp))
+                    poses.append(
+                        (
+                            p.position.x,
+                            p.position.y,
+                            p.position.z,
+                            p.orientation.x,
+                            p.orientation.y,
+                            p.orientation.z,
+                            p.orientation.w,
+                        )
+                    )
+        finally:
+            bag.close()
+        n = len(jointNames or [])
+        return BagSamples(
+            jointNames or [],
+            np.array(jointStamps, dtype=float),
+            np.array(jointPositions, dtype=float).reshape(-1, n),
+            np.array(poseStamps, dtype=float),
+            np.array(poses, dtype=float).reshape(-1, 7),
+        )
+
+    def synchronize(self, tolerance=1.0, interpolate=True):
+        """
+        Pair each detection with the joint values at the time of the detection
+        - tolerance: maximal time between a detection and the joint states
+          used for it (seconds),
+        - interpolate: whether joint values are linearly interpolated between
+          the joint states preceding and following the detection, when both
+          are within tolerance. Otherwise, the nearest joint state is used.
+
+        Detections without joint states within tolerance are dropped, all of
+        them if there is no joint state.
+        return an instance of BagSamples the joint stamps of which are the
+        stamps of the detections. Attribute statistics of the result is a
+        dictionary with keys
+        - detections: number of detections,
+        - paired: number of detections paired with joint states,
+        - interpolated: number of detections with interpolated joint values,
+        - dropped: number of detections dropped,
+        - unusedJointStates: number of joint states used by no detection,
+        - maxDelay: maximal time between a detection and the nearest joint
+          state used.
+        """
+        order = np.argsort(self.jointStamps, kind="mergesort")
+        stamps = self.jointStamps[order]
+        positions = self.jointPositions[order]
+        n = len(stamps)
+        if n == 0:
+            result = BagSamples(
+                self.jointNames,
+                stamps,
+                positions,
+                self.poseStamps[:0],
+                self.poses[:0],
+            )
+            result.statistics = dict(
+                detections=len(self.poses),
+                paired=0,
+                interpolated=0,
+                dropped=len(self.poses),
+                unusedJointStates=0,
+                maxDelay=None,
+            )
+            return result
+        # index of the first joint state after each detection
+        after = np.searchsorted(stamps, self.poseStamps)
+        before = after - 1
+        hasBefore = before >= 0
+        hasAfter = after < n
+        dtBefore = np.where(
+            hasBefore, self.poseStamps - stamps[np.clip(before, 0, n - 1)], np.inf
+        )
+        dtAfter = np.where(
+            hasAfter, stamps[np.clip(after, 0, n - 1)] - self.poseStamps, np.inf
+        )
+        nearest = np.where(dtBefore <= dtAfter, before, after)
+        delay = np.minimum(dtBefore, dtAfter)
+        paired = delay <= tolerance
+        both = (
+            interpolate
+            & paired
+            & (dtBefore <= tolerance)
+            & (dtAfter <= tolerance)
+            & (dtBefore + dtAfter > 0)
+        )
+        i0 = np.clip(before, 0, n - 1)
+        i1 = np.clip(after, 0, n - 1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            alpha = np.where(both, dtBefore / (dtBefore + dtAfter), 0.0)
+        values = np.where(
+            both[:, None],
+            (1 - alpha)[:, None] * positions[i0] + alpha[:, None] * positions[i1],
+            positions[np.clip(nearest, 0, n - 1)],
+        )
+        used = np.zeros(n, dtype=bool)
+        used[nearest[paired & ~both]] = True
+        used[before[both]] = True
+        used[after[both]] = True
+        result = BagSamples(
+            self.jointNames,
+            self.poseStamps[paired],
+            values[paired],
+            self.poseStamps[paired],
+            self.poses[paired],
+        )
+        result.statistics = dict(
+            detections=len(self.poses),
+            paired=int(paired.sum()),
+            interpolated=int(both.sum()),
+            dropped=int((~paired).sum()),
+            unusedJointStates=int((~used).sum()),
+            maxDelay=float(delay[paired].max()) if paired.any() else None,
+        )
+        return result
+
+    def save(self, filename, key):
+        with open(filename, "wb") as f:
+            np.savez(
+                f,
+                key=np.array(key),
+                jointNames=np.array(self.jointNames, dtype=np.str_),
+                **dict((k, getattr(self, k)) for k in self.arrays)
+            )
+
+    @staticmethod
+    def load(filename, key):
+        """
+        Load samples saved by method save, None if the key differs
+        """
+        data = np.load(filename)
+        if str(data["key"]) != key:
+            return None
+        return BagSamples(
+            data["jointNames"].tolist(), *[data[k] for k in BagSamples.arrays]
+        )
+
+
+def loadBag(path, jointTopic="joints", poseTopic="chessboard", cache=True):
+    """
+    Read the samples of a bag, using the cache next to the bag if it is up to
+    date
+    """
+    cacheFile = path + ".npz"
+    key = bagKey(path) + " " + jointTopic + " " + poseTopic
+    if cache and os.path.exists(cacheFile):
+        try:
+            samples = BagSamples.load(cacheFile, key)
+        except (IOError, KeyError, ValueError):
+            samples = None
+        if samples is not None:
+            return samples
+    samples = BagSamples.read(path, jointTopic, poseTopic)
+    if cache:
+        try:
+            samples.save(cacheFile, key)
+        except IOError:
+            # directory of the bag may be read-only
+            pass
+    return samples
@@ -0,0 +1,391 @@
+# /usr/bin/env python
+
+from math import pi
+
+import numpy as np
+
+# Sampling of poses of the chessboard in the camera frame
+#
+# Candidate poses are drawn by batches: the corners of the chessboard are
+# projected in the image for all candidates with one array operation, and
+# only the candidates that face the camera with the whole chessboard in the
+# image are kept.
+
+chessboard_pts = np.array(
+    [
+        [-0.05, -0.1, 0.0],
+        [0.25, -0.1, 0.0],
+        [0.25, 0.1, 0.0],
+        [-0.05, 0.1, 0.0],
+    ]
+)
+chessboard_normal = np.array([0.0, 0.0, -1.0])
+
+image_width = 1280
+image_height = 720
+projection_matrix = np.array(
+    [[999.195, 0.0, 646.3244], [0.0, 1008.400, 359.955], [0.0, 0.0, 1.0]]
+)
+
+
+def rpyToMatrix(rpy):
+    """
+    Rotation matrices R = Rz(yaw) Ry(pitch) Rx(roll) of a batch of
+    roll, pitch, yaw angles of dimension (N,3)
+    """
+    cr, cp, cy = np.cos(rpy).T
+    sr, sp, sy = np.sin(rpy).T
+    R = np.empty((len(rpy), 3, 3))
+    R[:, 0, 0] = cy * cp
+    R[:, 0, 1] = cy * sp * sr - sy * cr
+    R[:, 0, 2] = cy * sp * cr + sy * sr
+    R[:, 1, 0] = sy * cp
+    R[:, 1, 1] = sy * sp * sr + cy * cr
+    R[:, 1, 2] = sy * sp * cr - cy * sr
+    R[:, 2, 0] = -sp
+    R[:, 2, 1] = cp * sr
+    R[:, 2, 2] = cp * cr
+    return R
+
+
+def matrixToQuaternion(R):
+    """
+    Quaternions (x, y, z, w) of a batch of rotation matrices of dimension
+    (N,3,3)
+    """
+    # Squared components, from the diagonal
+    d = np.stack(
+        (
+            1 + R[:, 0, 0] - R[:, 1, 1] - R[:, 2, 2],
+            1 - R[:, 0, 0] + R[:, 1, 1] - R[:, 2, 2],
+            1 - R[:, 0, 0] - R[:, 1, 1] + R[:, 2, 2],
+            1 + R[:, 0, 0] + R[:, 1, 1] + R[:, 2, 2],
+        ),
+        axis=1,
+    )
+    # Compute the quaternion from its largest component for accuracy
+    k = np.argmax(d, axis=1)
+    s = 0.5 / np.sqrt(d[np.arange(len(R)), k])
+    q = np.empty((len(R), 4))
+    # off-diagonal sums and differences
+    xy = R[:, 0, 1] + R[:, 1, 0]
+    xz = R[:, 0, 2] + R[:, 2, 0]
+    yz = R[:, 1, 2] + R[:, 2, 1]
+    wx = R[:, 2, 1] - R[:, 1, 2]
+    wy = R[:, 0, 2] - R[:, 2, 0]
+    wz = R[:, 1, 0] - R[:, 0, 1]
+    rows = [
+        (d[:, 0], xy, xz, wx),
+        (xy, d[:, 1], yz, wy),
+        (xz, yz, d[:, 2], wz),
+        (wx, wy, wz, d[:, 3]),
+    ]
+    for i, row in enumerate(rows):
+        m = k == i
+        q[m] = np.stack([c[m] for c in row], axis=1) * s[m, None]
+    # positive w
+    q *= np.where(q[:, 3:4] < 0, -1.0, 1.0)
+    return q
+
+
+# Rotation from the frame in which the poses are sampled to the camera frame
+R_camera = rpyToMatrix(np.array([[-pi, 0, -pi]]))[0]
+
+
+def projectPoints(R, t, points=chessboard_pts):
+    """
+    Pixel coordinates of points of the chessboard for a batch of poses
+    - R: (N,3,3) rotations, t: (N,3) translations of the chessboard,
+    - points: (P,3) points in the chessboard frame.
+    return (N,P,2) pixel coordinates and (N,P) depths
+    """
+    p = np.einsum("nij,pj->npi", R, points) + t[:, None, :]
+    uvw = np.einsum("ij,npj->npi", projection_matrix, p)
+    return uvw[..., 0:2] / uvw[..., 2:3], uvw[..., 2]
+
+
+def visible(R, t):
+    """
+    Whether the chessboard faces the camera and all its corners are in the
+    image, for a batch of poses
+    """
+    faces = np.einsum("nij,j->ni", R, chessboard_normal)[:, 2] < 0
+    uv, depth = projectPoints(R, t)
+    inImage = (
+        (depth > 0)
+        & (uv[..., 0] >= 0)
+        & (uv[..., 0] < image_width)
+        & (uv[..., 1] >= 0)
+        & (uv[..., 1] < image_height)
+    )
+    return faces & inImage.all(axis=1)
+
+
+def posesFromSamples(x, y, depth, rpy):
+    """
+    Poses of the chessboard for batches of pixel coordinates of its origin,
+    depths and orientations
+    - x, y, depth: arrays of dimension (N,),
+    - rpy: array of dimension (N,3).
+    return rotations (N,3,3), translations (N,3) in the sampling frame and
+    the visibility of each pose.
+    """
+    t = np.stack(
+        (
+            (x - projection_matrix[0, 2]) / projection_matrix[0, 0] * depth,
+            (y - projection_matrix[1, 2]) / projection_matrix[1, 1] * depth,
+            depth,
+        ),
+        axis=1,
+    )
+    R = rpyToMatrix(rpy)
+    return R, t, visible(R, t)
+
+
+def toCameraPoses(R, t):
+    """
+    Convert poses to tuples (x, y, z, qx, qy, qz, qw) of the chessboard in the
+    camera frame "rgbd_rgb_optical_joint"
+    """
+    q = matrixToQuaternion(np.matmul(R_camera, R))
+    return [
+        tuple(float(v) for v in ti) + tuple(float(v) for v in qi)
+        for ti, qi in zip(t, q)
+    ]
+
+
+def samplePoses(
+    x, y, dist_from_camera, nSamples=1000, maxAngle=pi / 12.0, rng=np.random
+):
+    """
+    Sample poses of the chessboard with its origin at pixel (x, y)
+    - dist_from_camera: interval of depth,
+    - nSamples: number of candidates drawn,
+    - maxAngle: bound of the roll, pitch and yaw angles.
+    return the list of visible poses (x, y, z, qx, qy, qz, qw) in the camera
+    frame
+    """
+    depth = rng.uniform(dist_from_camera[0], dist_from_camera[1], nSamples)
+    rpy = rng.uniform(-maxAngle, maxAngle, (nSamples, 3))
+    R, t, ok = posesFromSamples(
+        np.full(nSamples, float(x)), np.full(nSamples, float(y)), depth, rpy
+    )
+    return toCameraPoses(R[ok], t[ok])
+
+
+def sampleCells(
+    cells, dist_from_camera, nSamples=1000, maxAngle=pi / 12.0, rng=np.random
+):
+    """
+    Sample poses of the chessboard for a list of pixels (x, y)
+    return the list of visible poses for each pixel
+    """
+    return [
+        samplePoses(x, y, dist_from_camera, nSamples, maxAngle, rng) for x, y in cells
+    ]
+
+
+primes = [2, 3, 5, 7, 11, 13, 17, 19]
+
+
+def halton(start, n, dim):
+    """
+    Points start to start + n - 1 of the Halton sequence in [0,1]^dim
+    return an array of dimension (n,dim)
+    """
+    result = np.zeros((n, dim))
+    for d in range(dim):
+        base = primes[d]
+        i = np.arange(start + 1, start + n + 1)
+        f = 1.0
+        while np.any(i > 0):
+            f /= base
+            result[:, d] += f * (i % base)
+            i //= base
+    return result
+
+
+class ViewpointPlanner(object):
+    """
+    Choose poses of the chessboard that cover the image, the depths and the
+    orientations of the chessboard
+
+    - dist_from_camera: interval of depth,
+    - xRange, yRange: intervals of pixel coordinates of the origin of the
+      chessboard,
+    - maxAngle: bound of the roll, pitch and yaw angles,
+    - cells: number of cells of the image along x and y,
+    - depthBins: number of intervals of depth,
+    - nCandidates: number of candidates kept in the pool,
+    - maxBatches: maximal number of batches of points of the Halton sequence
+      drawn to fill the pool.
+
+    Candidates are drawn from a Halton sequence over the pixel coordinates,
+    the depth and the roll, pitch and yaw angles, so that they spread evenly
+    without rejection of close samples. The coverage is measured on three
+    histograms: cells of the image, intervals of depth, and tilt of the
+    chessboard (facing the camera or tilted in one of 4 directions). The
+    score of a candidate is the sum over the histograms of 1 / (1 + count) of
+    its bin, minus proximity times its distance to the last accepted pose.
+    As the head is locked, a chessboard pose close to the previous one keeps
+    the arm close to the previous configuration, from which the projection
+    starts.
+
+    Usage:
+      planner = ViewpointPlanner(dist_from_camera)
+      pose = planner.next()
+      # project the robot configuration, then
+      planner.accept() # or planner.reject()
+    """
+
+    def __init__(
+        self,
+        dist_from_camera,
+        xRange=(400, 800),
+        yRange=(300, 450),
+        maxAngle=pi / 12.0,
+        cells=(9, 4),
+        depthBins=3,
+        nCandidates=200,
+        maxBatches=50,
+    ):
+        self.dist_from_camera = dist_from_camera
+        self.xRange = xRange
+        self.yRange = yRange
+        self.maxAngle = maxAngle
+        self.cells = cells
+        self.depthBins = depthBins
+        self.nCandidates = nCandidates
+        self.maxBatches = maxBatches
+        self.proximity = 0.5
+        self.imageCount = np.zeros(cells[0] * cells[1], dtype=int)
+        self.depthCount = np.zeros(depthBins, dtype=int)
+        self.tiltCount = np.zeros(5, dtype=int)
+        self.index = 0
+        self.R = np.zeros((0, 3, 3))
+        self.t = np.zeros((0, 3))
+        self.bins = np.zeros((0, 3), dtype=int)
+        self.previous = None
+        self.current = None
+        self.accepted = 0
+        self.rejected = 0
+
+    def binsOf(self, x, y, R, t):
+        """
+        Bins of the image, depth and tilt histograms of poses
+        """
+        nx, ny = self.cells
+        u = (x - self.xRange[0]) / float(self.xRange[1] - self.xRange[0])
+        v = (y - self.yRange[0]) / float(self.yRange[1] - self.yRange[0])
+        i = np.clip((u * nx).astype(int), 0, nx - 1)
+        j = np.clip((v * ny).astype(int), 0, ny - 1)
+        d0, d1 = self.dist_from_camera
+        depth = (t[:, 2] - d0) / (d1 - d0)
+        k = np.clip((depth * self.depthBins).astype(int), 0, self.depthBins - 1)
+        # tilt of the normal of the chessboard with respect to the optical axis
+        n = np.einsum("nij,j->ni", R, chessboard_normal)
+        frontal = np.hypot(n[:, 0], n[:, 1]) < np.sin(self.maxAngle / 2)
+        direction = (
+            np.floor((np.arctan2(n[:, 1], n[:, 0]) + pi / 4) / (pi / 2)).astype(int)
+            % 4
+        )
+        tilt = np.where(frontal, 0, 1 + direction)
+        return np.stack((i * ny + j, k, tilt), axis=1)
+
+    def refill(self):
+        """
+        Add the visible poses of the next points of the Halton sequence to the
+        pool of candidates, until the pool is full or maxBatches batches have
+        been drawn. Raise RuntimeError if the pool is still empty.
+        """
+        batches = 0
+        while len(self.t) < self.nCandidates and batches < self.maxBatches:
+            batches += 1
+            n = 4 * self.nCandidates
+            h = halton(self.index, n, 6)
+            self.index += n
+            x = self.xRange[0] + h[:, 0] * (self.xRange[1] - self.xRange[0])
+            y = self.yRange[0] + h[:, 1] * (self.yRange[1] - self.yRange[0])
+            d0, d1 = self.dist_from_camera
+            depth = d0 + h[:, 2] * (d1 - d0)
+            rpy = self.maxAngle * (2 * h[:, 3:6] - 1)
+            R, t, ok = posesFromSamples(x, y, depth, rpy)
+            self.R = np.concatenate((self.R, R[ok]))
+            self.t = np.concatenate((self.t, t[ok]))
+            self.bins = np.concatenate((self.bins, self.binsOf(x, y, R, t)[ok]))
+        if len(self.t) == 0:
+            raise RuntimeError(
+                "No visible pose of the chessboard in {} samples with x in {}, "
+                "y in {}, depth in {} and angles up to {} rad.".format(
+                    batches * 4 * self.nCandidates,
+                    list(self.xRange),
+                    list(self.yRange),
+                    list(self.dist_from_camera),
+                    self.maxAngle,
+                )
+            )
+
+    def scores(self):
+        """
+        Scores of the candidates of the pool
+        """
+        gain = (
+            1.0 / (1 + self.imageCount[self.bins[:, 0]])
+            + 1.0 / (1 + self.depthCount[self.bins[:, 1]])
+            + 1.0 / (1 + self.tiltCount[self.bins[:, 2]])
+        )
+        if self.previous is None:
+            return gain
+        R0, t0 = self.previous
+        d0, d1 = self.dist_from_camera
+        dt = np.linalg.norm(self.t - t0, axis=1) / (d1 - d0)
+        # angle between the orientations
+        c = (np.einsum("nij,ij->n", self.R, R0) - 1) / 2
+        angle = np.arccos(np.clip(c, -1, 1)) / (2 * self.maxAngle)
+        return gain - self.proximity * (dt + angle)
+
+    def next(self):
+        """
+        Best candidate, as a pose (x, y, z, qx, qy, qz, qw) of the chessboard
+        in the camera frame
+        """
+        self.refill()
+        self.current = int(np.argmax(self.scores()))
+        c = self.current
+        return toCameraPoses(self.R[c : c + 1], self.t[c : c + 1])[0]
+
+    def remove(self, c):
+        keep = np.arange(len(self.t)) != c
+        self.R, self.t, self.bins = self.R[keep], self.t[keep], self.bins[keep]
+        self.current = None
+
+    def accept(self):
+        """
+        Record that the robot reaches the current candidate
+        """
+        c = self.current
+        i, k, tilt = self.bins[c]
+        self.imageCount[i] += 1
+        self.depthCount[k] += 1
+        self.tiltCount[tilt] += 1
+        self.previous = (self.R[c], self.t[c])
+        self.accepted += 1
+        self.remove(c)
+
+    def reject(self):
+        """
+        Record that the robot cannot reach the current candidate
+        """
+        self.rejected += 1
+        self.remove(self.current)
+
+    def coverage(self):
+        """
+        Fractions of the cells of the image, of the intervals of depth and of
+        the tilts reached by the accepted poses
+        """
+        return dict(
+            image=float(np.mean(self.imageCount > 0)),
+            depth=float(np.mean(self.depthCount > 0)),
+            tilt=float(np.mean(self.tiltCount > 0)),
+        )
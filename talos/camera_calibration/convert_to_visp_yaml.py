@@ -2,8 +2,8 @@
 
 import time
 
-import rosbag
 import rospy
+from bag_loader import loadBag
 from geometry_msgs.msg import Transform as TransformROS
 from hpp import Transform
 from hpp.corbaserver.manipulation.robot import CorbaClient, Robot
@@ -23,7 +23,8 @@ def publishTransform(publisher, transform):
 
 
 client = CorbaClient()
-bag = rosbag.Bag("/usr/localDev/rosbag-calib/pyrene-calib.bag")
+samples = loadBag("/usr/localDev/rosbag-calib/pyrene-calib.bag").synchronize()
+print("Samples: " + str(samples.statistics))
 
 Robot.packageName = "agimus_demos"
 Robot.urdfName = "talos"
@@ -38,34 +39,22 @@ pub_fMe = rospy.Publisher("/world_effector", TransformROS, queue_size=100)
 rospy.init_node("pose_sender", anonymous=True)
 
 i = 0
-for (_, joint_states, _), (_, checkerboard_pose, _) in zip(
-    bag.read_messages(topics=["joints"]), bag.read_messages(topics=["chessboard"])
-):
+for joint_positions, checkerboard_pose in zip(samples.jointPositions, samples.poses):
 
     root_joint_rank = robot.rankInConfiguration["talos/root_joint"]
     q[root_joint_rank : root_joint_rank + 7] = [0, 0, 1, 0, 0, 0, 1]
 
-    joints_name_value_tuple = zip(joint_states.name, joint_states.position)
+    joints_name_value_tuple = zip(samples.jointNames, joint_positions)
     for name, value in joints_name_value_tuple:
         joint_name = "talos/" + name
-        q[robot.rankInConfiguration[joint_name]] = value
+        q[robot.rankInConfiguration[joint_name]] = float(value)
     robot.setCurrentConfig(q)
 
     gripper = Transform(robot.getJointPosition("talos/gripper_left_base_link_joint"))
     camera = Transform(robot.getJointPosition("talos/rgbd_rgb_optical_joint"))
     fMe = gripper.inverse() * camera
 
-    cMo = Transform(
-        [
-            checkerboard_pose.pose.position.x,
-            checkerboard_pose.pose.position.y,
-            checkerboard_pose.pose.position.z,
-            checkerboard_pose.pose.orientation.x,
-            checkerboard_pose.pose.orientation.y,
-            checkerboard_pose.pose.orientation.z,
-            checkerboard_pose.pose.orientation.w,
-        ]
-    )
+    cMo = Transform(list(checkerboard_pose))
 
     publishTransform(pub_cMo, cMo)
     publishTransform(pub_fMe, fMe)
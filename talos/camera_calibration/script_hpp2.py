@@ -1,9 +1,7 @@
 # /usr/bin/env python
-import random
-from math import pi
-
 import numpy as np
-from hpp import Quaternion, Transform
+from chessboard_poses import ViewpointPlanner
+from hpp import Transform
 from hpp.corbaserver.manipulation import (
     ConstraintGraph,
     ProblemSolver,
@@ -112,38 +110,12 @@ half_sitting = [
 ]
 q_init = robot.getCurrentConfig()
 
-# INIT CHESSBOARD AND CAMERA PARAM AND FUNCTIONS
-chessboard_pts = [
-    [-0.05, -0.1, 0.0],
-    [0.25, -0.1, 0.0],
-    [0.25, 0.1, 0.0],
-    [-0.05, 0.1, 0.0],
-]
-chessboard_normal = np.matrix([0.0, 0.0, -1.0]).transpose()
-
-image_width = 1280
-image_height = 720
-projection_matrix = np.matrix(
-    [[999.195, 0.0, 646.3244], [0.0, 1008.400, 359.955], [0.0, 0.0, 1.0]]
-)
-
+# Interval of distance of the chessboard to the camera
 dist_from_camera = [0.3, 0.45]
-camera_position = np.matrix([0.0, 0.0, 0.0])
-
-
-def isInImage(coord):
-    x = coord[0, 0]
-    y = coord[1, 0]
-    return (x >= 0) & (x < image_width) & (y >= 0) & (y < image_height)
-
-
-def projectPoint(Rt, pt):
-    coord = projection_matrix * Rt * np.vstack((pt, np.matrix([1])))
-    coord /= coord[2, 0]
-    return coord[0:2, 0]
-
-
-# END INIT CHESSBOARD AND CAMERA PARAM AND FUNCTIONS
+# Number of poses of the chessboard
+nb_poses = 36
+# Maximal number of poses that the robot cannot reach
+max_failures = 200
 
 
 ps.addPartialCom("talos", ["talos/root_joint"])
@@ -223,83 +195,49 @@ q_proj_list = []
 
 expected_poses = []
 
-# Randomize the position of the chessboard
+# Choose the poses of the chessboard with a coverage planner
 # The chessboard is on the right of the plate, so we shift the gaze (pointing to the centre of the plate) to the left
-ys = [300, 350, 400, 450]
-for x in [400, 450, 500, 550, 600, 650, 700, 750, 800]:
-    for y in ys:
-        # Keep only poses where the chessboard can be seen from the camera
-        setGuassianShooter(qrand)
-        shoot_pose = 0
-        shoot_cfg = 0
-        while True:
-            chessboard_Z = random.uniform(dist_from_camera[0], dist_from_camera[1])
-            chessboard_X = (
-                (x - projection_matrix[0, 2]) / projection_matrix[0, 0] * chessboard_Z
-            )
-            chessboard_Y = (
-                (y - projection_matrix[1, 2]) / projection_matrix[1, 1] * chessboard_Z
-            )
-            chessboard_position = np.matrix([chessboard_X, chessboard_Y, chessboard_Z])
-
-            q = Quaternion().fromRPY(
-                random.uniform(-pi / 12.0, pi / 12.0),
-                random.uniform(-pi / 12.0, pi / 12.0),
-                random.uniform(-pi / 12.0, pi / 12.0),
-            )
-            shoot_pose += 1
-            R = q.toRotationMatrix()
-            if (R * chessboard_normal)[2] >= 0.0:
-                continue
-
-            Rt = np.hstack((R, (chessboard_position - camera_position).transpose()))
-
-            if not all(
-                [
-                    isInImage(projectPoint(Rt, np.matrix(pt).transpose()))
-                    for pt in chessboard_pts
-                ]
-            ):
-                continue
-
-            q = Quaternion().fromRPY(-pi, 0, -pi) * q  # Switch tn the real camera frame
-
-            chessboard_pose = (
-                chessboard_position[0, 0],
-                chessboard_position[0, 1],
-                chessboard_position[0, 2],
-            ) + q.toTuple()
-            ps.createTransformationConstraint(
-                "gaze",
-                "talos/rgbd_rgb_optical_joint",
-                "mire/root_joint",
-                chessboard_pose,
-                [True] * 6,
-            )
-
-            ps.resetConstraints()
-            ps.setNumericalConstraints(
-                "proj",
-                foot_placement
-                + ["com_talos_mire", "talos/left_gripper grasps mire/left", "gaze"],
-            )
-            ps.setLockedJointConstraints(
-                "proj", left_gripper_lock + right_gripper_lock + other_lock
-            )
-
-            res, qproj, err = ps.applyConstraints(qrand)
-            if res:
-                valid, msg = robot.isConfigValid(qproj)
-                if valid:
-                    print("Found pose", shoot_pose, "\t", shoot_cfg)
-                    expected_poses.append(chessboard_pose)
-                    q_proj_list.append(qproj)
-                    qrand = qproj[:]
-                    break
-            # It may be needed to shoot from time to time but so far it works without doing it.
-            # qrand = robot.shootRandomConfig()
-            # shoot_cfg += 1
-    ys.reverse()
+planner = ViewpointPlanner(dist_from_camera, xRange=(400, 800), yRange=(300, 450))
+shoot_pose = 0
+while len(q_proj_list) < nb_poses and planner.rejected < max_failures:
+    chessboard_pose = planner.next()
+    shoot_pose += 1
+    setGuassianShooter(qrand)
+    ps.createTransformationConstraint(
+        "gaze",
+        "talos/rgbd_rgb_optical_joint",
+        "mire/root_joint",
+        chessboard_pose,
+        [True] * 6,
+    )
+
+    ps.resetConstraints()
+    ps.setNumericalConstraints(
+        "proj",
+        foot_placement
+        + ["com_talos_mire", "talos/left_gripper grasps mire/left", "gaze"],
+    )
+    ps.setLockedJointConstraints(
+        "proj", left_gripper_lock + right_gripper_lock + other_lock
+    )
+
+    res, qproj, err = ps.applyConstraints(qrand)
+    if res and robot.isConfigValid(qproj)[0]:
+        print("Found pose", shoot_pose, "\t", planner.coverage())
+        planner.accept()
+        expected_poses.append(chessboard_pose)
+        q_proj_list.append(qproj)
+        qrand = qproj[:]
+    else:
+        planner.reject()
+print(
+    "Projections:",
+    shoot_pose,
+    ", failed:",
+    planner.rejected,
+    ", coverage:",
+    planner.coverage(),
+)
 
 hpp_poses = []
 for q in q_proj_list:
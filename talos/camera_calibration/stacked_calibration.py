@@ -0,0 +1,371 @@
+# /usr/bin/env python
+
+# Estimation of the camera pose from chessboard detections with a single
+# kinematic model.
+#
+# Model "talos_calibration_camera" contains two free-flyer joints:
+# - calib_rgb_joint, the configuration C of which is the correction of the
+#   pose of the camera,
+# - calib_mire_joint_2, the configuration X of which is the pose of the
+#   chessboard with respect to the gripper.
+# For each sample j, all other joints are locked to the measured joint values
+# q_j. Let
+# - A_j be the pose of calib_mire_joint_2 in calib_rgb_joint when C and X are
+#   the identity,
+# - M_j be the pose of the chessboard detected in the camera.
+# The detection is explained by the model if M_j = C^-1 * A_j * X, which, in
+# SE(3), can be written
+#   e_j (C, X) = log( M_j^-1 * C^-1 * A_j * X ) = 0
+# The problem is then to minimize the sum over j of || e_j (C, X) ||^2.
+#
+# A_j does not depend on the unknowns: it is computed once per sample by
+# forward kinematics. The cost of an iteration is then linear in the number
+# of samples, and the problem has 12 unknowns whatever the number of
+# samples.
+
+import math
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+import pinocchio
+from pinocchio import SE3, Jlog6, Quaternion, exp6, log6
+
+pinocchio.switchToNumpyArray()
+
+
+def poseToSE3(pose):
+    """
+    Convert a pose (x, y, z, qx, qy, qz, qw) to SE3
+    """
+    return SE3(
+        Quaternion(x=pose[3], y=pose[4], z=pose[5], w=pose[6]).matrix(),
+        np.array(pose[0:3], dtype=float),
+    )
+
+
+def se3ToPose(T):
+    """
+    Convert a SE3 element to a pose (x, y, z, qx, qy, qz, qw)
+    """
+    return tuple(
+        float(v)
+        for v in np.concatenate(
+            (
+                np.array(T.translation).reshape(3),
+                np.array(Quaternion(T.rotation).coeffs()).reshape(4),
+            )
+        )
+    )
+
+
+def messageToPose(pose):
+    """
+    Convert a geometry_msgs/Pose message to a pose (x, y, z, qx, qy, qz, qw)
+    """
+    return (
+        pose.position.x,
+        pose.position.y,
+        pose.position.z,
+        pose.orientation.x,
+        pose.orientation.y,
+        pose.orientation.z,
+        pose.orientation.w,
+    )
+
+
+class StackedCalibration(object):
+    """
+    Least-squares estimation of the configurations of calib_rgb_joint and
+    calib_mire_joint_2 over all samples
+
+    - robot: hpp Robot loaded with model "talos_calibration_camera", used
+      to compute the relative pose A_j of each sample,
+    - prefix: prefix of the joint names of the robot.
+
+    After solve, self.C and self.X contain the configurations of
+    calib_rgb_joint and calib_mire_joint_2.
+    """
+
+    rgbJoint = "calib_rgb_joint"
+    mireJoint = "calib_mire_joint_2"
+
+    def __init__(self, robot=None, prefix="talos/"):
+        self.robot = robot
+        self.prefix = prefix
+        self.A = list()
+        self.M = list()
+        self.C = SE3.Identity()
+        self.X = SE3.Identity()
+        self.damping = 1e-3
+        self.tolerance = 1e-10
+        if robot is not None:
+            self.q = robot.getCurrentConfig()
+            rank = robot.rankInConfiguration[prefix + "root_joint"]
+            self.q[rank : rank + 7] = [0, 0, 1, 0, 0, 0, 1]
+            # Relative poses are computed with identity configurations of the
+            # calibration joints.
+            for joint in [self.rgbJoint, self.mireJoint]:
+                rank = robot.rankInConfiguration[prefix + joint]
+                self.q[rank : rank + 7] = [0, 0, 0, 0, 0, 0, 1]
+
+    def __len__(self):
+        return len(self.A)
+
+    def addSample(self, joint_states, checkerboard_pose):
+        """
+        Add a sample
+        - joint_states: sensor_msgs/JointState message,
+        - checkerboard_pose: geometry_msgs/Pose message, pose of the
+          chessboard in the camera.
+        """
+        self.addSampleValues(
+            joint_states.name, joint_states.position, messageToPose(checkerboard_pose)
+        )
+
+    def addSampleValues(self, jointNames, jointValues, pose):
+        """
+        Add a sample
+        - jointNames, jointValues: names and values of the measured joints,
+        - pose: pose of the chessboard in the camera (x, y, z, qx, qy, qz, qw).
+        """
+        q = list(self.q)
+        for name, value in zip(jointNames, jointValues):
+            q[self.robot.rankInConfiguration[self.prefix + name]] = float(value)
+        self.robot.setCurrentConfig(q)
+        rgb = poseToSE3(self.robot.getJointPosition(self.prefix + self.rgbJoint))
+        mire = poseToSE3(self.robot.getJointPosition(self.prefix + self.mireJoint))
+        self.addRelativePose(rgb.inverse() * mire, poseToSE3(pose))
+
+    def addRelativePose(self, A, M):
+        """
+        Add a sample from its relative pose A and detected pose M (SE3)
+        """
+        self.A.append(A)
+        self.M.append(M)
+
+    def residuals(self, samples=None, C=None, X=None):
+        """
+        Residuals e_j (C, X) of the samples, as an array of dimension
+        (len(samples), 6). Default values are all samples and the current
+        estimate.
+        """
+        if samples is None:
+            samples = range(len(self.A))
+        C = self.C if C is None else C
+        X = self.X if X is None else X
+        Cinv = C.inverse()
+        return np.array(
+            [log6(self.M[j].inverse() * Cinv * self.A[j] * X).vector for j in samples]
+        ).reshape(-1, 6)
+
+    def errors(self, samples=None, C=None, X=None):
+        """
+        Norms of the residuals of the samples
+        """
+        return np.linalg.norm(self.residuals(samples, C, X), axis=1)
+
+    def normalEquations(self, samples):
+        """
+        Compute J^T J, J^T e and the cost 1/2 ||e||^2 over samples, where the
+        columns of J correspond to the variations of C and X in their local
+        frames.
+        """
+        JtJ = np.zeros((12, 12))
+        Jte = np.zeros(12)
+        cost = 0.0
+        Cinv = self.C.inverse()
+        J = np.zeros((6, 12))
+        for j in samples:
+            AX = self.A[j] * self.X
+            E = self.M[j].inverse() * Cinv * AX
+            e = log6(E).vector
+            Jlog = Jlog6(E)
+            # C exp(dc): E exp(-Ad(X^-1 A_j^-1 C) dc)
+            J[:, 0:6] = -Jlog.dot((AX.inverse() * self.C).action)
+            # X exp(dx): E exp(dx)
+            J[:, 6:12] = Jlog
+            JtJ += J.T.dot(J)
+            Jte += J.T.dot(e)
+            cost += 0.5 * e.dot(e)
+        return JtJ, Jte, cost
+
+    def solve(self, samples=None, maxIterations=100, C=None, X=None):
+        """
+        Minimize the sum of the squared residuals of the samples with
+        Levenberg-Marquardt algorithm, starting from C and X (default: the
+        current estimate)
+
+        return the configurations of calib_rgb_joint and calib_mire_joint_2 as
+        poses (x, y, z, qx, qy, qz, qw) and the maximal error over the samples.
+        """
+        if samples is None:
+            samples = range(len(self.A))
+        if C is not None:
+            self.C = C
+        if X is not None:
+            self.X = X
+        lam = self.damping
+        JtJ, Jte, cost = self.normalEquations(samples)
+        for iteration in range(maxIterations):
+            d = np.maximum(np.diag(JtJ), 1e-12)
+            dy = -np.linalg.solve(JtJ + lam * np.diag(d), Jte)
+            C0, X0 = self.C, self.X
+            self.C = C0 * exp6(dy[0:6])
+            self.X = X0 * exp6(dy[6:12])
+            newJtJ, newJte, newCost = self.normalEquations(samples)
+            if newCost < cost:
+                decrease = cost - newCost
+                JtJ, Jte, cost = newJtJ, newJte, newCost
+                lam /= 3.0
+                if (
+                    np.linalg.norm(dy) < self.tolerance
+                    or decrease < self.tolerance * cost
+                ):
+                    break
+            else:
+                self.C, self.X = C0, X0
+                lam *= 2.0
+                if np.linalg.norm(dy) < self.tolerance:
+                    break
+        return se3ToPose(self.C), se3ToPose(self.X), self.errors(samples).max()
+
+
+# Samples of the calibration problem in the current worker process
+_calibration = None
+
+
+def _initWorker(A, M):
+    global _calibration
+    _calibration = StackedCalibration()
+    for a, m in zip(A, M):
+        _calibration.addRelativePose(SE3(a), SE3(m))
+
+
+def _evaluateHypotheses(samples):
+    """
+    Solve the problem on each minimal sample and return the errors of all
+    samples for the resulting estimate
+    """
+    calib = _calibration
+    result = list()
+    for sample in samples:
+        calib.solve(sample, C=SE3.Identity(), X=SE3.Identity())
+        result.append(
+            (
+                np.array(calib.C.homogeneous),
+                np.array(calib.X.homogeneous),
+                calib.errors(),
+            )
+        )
+    return result
+
+
+class Ransac(object):
+    """
+    Robust estimation of the camera pose with adaptive RANSAC
+
+    - calibration: instance of StackedCalibration containing the samples,
+    - threshold: maximal error of an inlier,
+    - sampleSize: number of samples of a hypothesis,
+    - confidence: probability that at least one hypothesis contains only
+      inliers,
+    - maxIterations: maximal number of hypotheses,
+    - nProcesses: number of worker processes,
+    - seed: seed of the random number generator.
+
+    Hypotheses are computed in batches by a pool of processes. Each hypothesis
+    is scored by the number of samples whose residual is below the threshold:
+    evaluating the residuals of the samples does not require any optimization.
+    After each batch, the number of hypotheses needed to reach the confidence
+    is updated from the best inlier ratio observed so far, so that the loop
+    stops early when there are few outliers. The estimate is finally refined
+    on the inliers of the best hypothesis.
+    """
+
+    def __init__(
+        self,
+        calibration,
+        threshold=0.02,
+        sampleSize=3,
+        confidence=0.99,
+        maxIterations=1000,
+        nProcesses=None,
+        seed=0,
+    ):
+        self.calibration = calibration
+        self.threshold = threshold
+        self.sampleSize = sampleSize
+        self.confidence = confidence
+        self.maxIterations = maxIterations
+        self.nProcesses = nProcesses or cpu_count()
+        self.rng = np.random.RandomState(seed)
+
+    def requiredIterations(self, inlierRatio):
+        """
+        Number of hypotheses such that one of them contains only inliers with
+        probability self.confidence
+        """
+        p = inlierRatio ** self.sampleSize
+        if p >= 1.0:
+            return 1
+        if p <= 0.0:
+            return self.maxIterations
+        return int(math.ceil(math.log(1 - self.confidence) / math.log(1 - p)))
+
+    def run(self):
+        """
+        return the configurations of calib_rgb_joint and calib_mire_joint_2 as
+        poses (x, y, z, qx, qy, qz, qw), the maximal error over the inliers and
+        the list of inliers.
+        """
+        calib = self.calibration
+        N = len(calib)
+        if N < self.sampleSize:
+            raise RuntimeError(
+                "{} sample(s), at least {} are needed to compute a "
+                "hypothesis.".format(N, self.sampleSize)
+            )
+        A = [np.array(a.homogeneous) for a in calib.A]
+        M = [np.array(m.homogeneous) for m in calib.M]
+        batchSize = 4 * self.nProcesses
+        pool = None
+        if self.nProcesses > 1:
+            pool = Pool(self.nProcesses, _initWorker, (A, M))
+        else:
+            _initWorker(A, M)
+        try:
+            best = None
+            bestCount = -1
+            iteration = 0
+            required = self.maxIterations
+            while iteration < min(required, self.maxIterations):
+                n = min(batchSize, self.maxIterations - iteration)
+                samples = [
+                    list(self.rng.choice(N, self.sampleSize, replace=False))
+                    for i in range(n)
+                ]
+                if pool is None:
+                    results = _evaluateHypotheses(samples)
+                else:
+                    chunks = [
+                        samples[k :: self.nProcesses] for k in range(self.nProcesses)
+                    ]
+                    results = sum(pool.map(_evaluateHypotheses, chunks), [])
+                for C, X, errors in results:
+                    count = int(np.sum(errors < self.threshold))
+                    if count > bestCount:
+                        best, bestCount = (C, X), count
+                iteration += n
+                required = self.requiredIterations(float(bestCount) / N)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.iterations = iteration
+        # Refine on the inliers of the best hypothesis
+        C, X = SE3(best[0]), SE3(best[1])
+        inliers = list(np.flatnonzero(calib.errors(C=C, X=X) < self.threshold))
+        if len(inliers) < self.sampleSize:
+            inliers = list(range(N))
+        rgb_pose, mire_pose, error = calib.solve(inliers, C=C, X=X)
+        return rgb_pose, mire_pose, error, inliers
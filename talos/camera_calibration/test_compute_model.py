@@ -3,7 +3,7 @@
 import math
 import random
 
-import rosbag
+from bag_loader import loadBag
 from hpp import Transform
 from hpp.corbaserver.manipulation import ProblemSolver
 from hpp.corbaserver.manipulation.robot import CorbaClient, Robot
@@ -107,18 +107,10 @@ class Calibration(object):
         return rank, size
 
     def setGaze(self, robot_id, checkerboard_pose):
+        # checkerboard_pose: (x, y, z, qx, qy, qz, qw)
         robot_name = "talos_" + str(robot_id)
-        position = (
-            checkerboard_pose.position.x,
-            checkerboard_pose.position.y,
-            checkerboard_pose.position.z,
-        )
-        orientation = (
-            checkerboard_pose.orientation.x,
-            checkerboard_pose.orientation.y,
-            checkerboard_pose.orientation.z,
-            checkerboard_pose.orientation.w,
-        )
+        position = tuple(checkerboard_pose[0:3])
+        orientation = tuple(checkerboard_pose[3:7])
         self.ps.createPositionConstraint(
             robot_name + "gaze",
             robot_name + "/calib_rgb_joint",
@@ -184,15 +176,10 @@ class Calibration(object):
 
 
 def openBag(path, calib, robot_id):
-    bag = rosbag.Bag(path)
-
-    joint_states = bag.read_messages(topics=["/joint_states"]).next().message
-    joints_name_value_tuple = zip(joint_states.name, joint_states.position)
+    samples = loadBag(path, "/joint_states", "/checkerdetector/objectdetection_pose")
 
-    checkerboard_pose = (
-        bag.read_messages(topics=["/checkerdetector/objectdetection_pose"])
-        .next()
-        .message.pose
+    joints_name_value_tuple = zip(
+        samples.jointNames, [float(v) for v in samples.jointPositions[0]]
     )
 
     # robot_id = calib.initRobot()
@@ -229,14 +216,9 @@ def openBag(path, calib, robot_id):
     mire_pose = Transform(
         calib.robot.getJointPosition("talos_" + str(robot_id) + "/calib_mire_joint_2")
     )
-    t = (rgb_pose.inverse() * mire_pose).toTuple()
-    checkerboard_pose.position.x = t[0]
-    checkerboard_pose.position.y = t[1]
-    checkerboard_pose.position.z = t[2]
-    checkerboard_pose.orientation.x = t[3]
-    checkerboard_pose.orientation.y = t[4]
-    checkerboard_pose.orientation.z = t[5]
-    checkerboard_pose.orientation.w = t[6]
+    # The detection is replaced by the pose of the chessboard in the camera
+    # computed with the perturbed calibration joints.
+    checkerboard_pose = (rgb_pose.inverse() * mire_pose).toTuple()
     calib.q[robot_id * 65 + 28 : robot_id * 65 + 28 + 7] = [
         0.0,
         0.0,
@@ -259,7 +241,6 @@ def openBag(path, calib, robot_id):
 
     calib.setGaze(robot_id, checkerboard_pose)
 
-    bag.close()
     return checkerboard_pose
 
 